@@ -0,0 +1,127 @@
+import os
+import random
+
+WORDS = (
+    "chiropractic care spine posture pain relief clinic treatment back neck shoulder "
+    "health movement adjustment wellness session local patients practitioner "
+    "appointment therapy mobility injury recovery exercise stretch support"
+).split()
+
+SPAN_STYLES = (
+    "",
+    "font-weight: bold;",
+    "font-style: italic;",
+    "text-decoration: underline;",
+    "font-weight: bold; font-size: 18px;",
+    "font-style: italic; text-decoration: underline;",
+)
+
+BLOCK_STYLE = "text-align: left; margin-top: 0.5em; margin-bottom: 0.5em;"
+HEADING_STYLE = "text-align: left; margin-top: 1em; margin-bottom: 0.5em;"
+LIST_STYLE = "margin-block-start: 1em; margin-block-end: 1em;"
+ITEM_STYLE = "text-align: left; list-style-type: disc; margin-top: 0.5em; margin-bottom: 0.5em;"
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + ". "
+
+
+def _spans(rng, span_density):
+    """A run of spans; ``span_density`` is the chance of each extra span"""
+    spans = []
+    while True:
+        style = rng.choice(SPAN_STYLES)
+        attr = f' style="{style}"' if style else ""
+        spans.append(f"<span{attr}>{_sentence(rng, rng.randint(3, 12))}</span>")
+        if rng.random() >= span_density:
+            return "".join(spans)
+
+
+def _list(rng, depth, list_depth, span_density):
+    tag = rng.choice(("ul", "ol"))
+    items = []
+    for _ in range(rng.randint(2, 5)):
+        nested = ""
+        if depth < list_depth and rng.random() < 0.3:
+            nested = _list(rng, depth + 1, list_depth, span_density)
+        items.append(f'<li style="{ITEM_STYLE}">{_spans(rng, span_density)}{nested}</li>')
+    return f'<{tag} style="{LIST_STYLE}">{"".join(items)}</{tag}>'
+
+
+def generate_page(rng, paragraphs=40, span_density=0.6, list_depth=1):
+    """Generate the HTML of one Coda-style export page
+
+    Args:
+        rng (random.Random): Random source
+        paragraphs (int): Number of top-level blocks
+        span_density (float): Chance (0-1) of each paragraph gaining another span
+        list_depth (int): Maximum nesting depth of lists
+
+    Returns:
+        str: The page HTML
+    """
+    blocks = []
+    for _ in range(paragraphs):
+        kind = rng.random()
+        if kind < 0.1:
+            level = rng.choice((2, 3))
+            blocks.append(f'<h{level} style="{HEADING_STYLE}"><span>{_sentence(rng, 5)}</span></h{level}>')
+        elif kind < 0.2:
+            blocks.append(_list(rng, 1, list_depth, span_density))
+        elif kind < 0.25:
+            blocks.append(f'<div style="{BLOCK_STYLE}"><br></div>')
+        else:
+            blocks.append(f'<div style="{BLOCK_STYLE}">{_spans(rng, span_density)}</div>')
+    return "".join(blocks)
+
+
+FRAGMENT_TAGS = ("div", "p", "h2", "h3", "ul", "ol", "li", "span", "b", "em", "u", "strong", "a", "br",
+                 "script", "style", "rt")
+FRAGMENT_STYLES = ("", "font-weight: bold;", "text-align: center; font-size: 12pt;",
+                   "font-style: italic; text-decoration: underline", "text-align: ;")
+FRAGMENT_TEXT = ("hi ", "  ", "&amp; x", "\n", "text<", "\u00e9")
+FRAGMENT_DEBRIS = ("</span>", "</li>", "</div>", "<br/>", "<span/>", "</p>", "<!-- c -->", "</br>")
+
+
+def random_fragment(rng, depth=0):
+    """Generate a small, often malformed HTML fragment
+
+    Unlike ``generate_page`` it mixes in stray end tags, unclosed elements,
+    comments, scripts and odd styles, to find inputs where the converter
+    backends disagree.
+    """
+    parts = []
+    for _ in range(rng.randint(0, 4)):
+        kind = rng.random()
+        if kind < 0.3 or depth > 3:
+            parts.append(rng.choice(FRAGMENT_TEXT))
+        elif kind < 0.35:
+            parts.append(rng.choice(FRAGMENT_DEBRIS))
+        else:
+            tag = rng.choice(FRAGMENT_TAGS)
+            if tag == "br":
+                parts.append("<br>")
+                continue
+            style = rng.choice(FRAGMENT_STYLES)
+            attr = f' style="{style}"' if style else rng.choice(("", " style"))
+            end = f"</{tag}>" if rng.random() < 0.9 else ""
+            parts.append(f"<{tag}{attr}>{random_fragment(rng, depth + 1)}{end}")
+    return "".join(parts)
+
+
+def generate_corpus(out_dir, pages=100, paragraphs=40, span_density=0.6, list_depth=1, seed=0):
+    """Write a synthetic corpus of export pages to ``out_dir``
+
+    Returns:
+        int: Total bytes written
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    total = 0
+    for i in range(pages):
+        html = generate_page(rng, paragraphs, span_density, list_depth)
+        path = os.path.join(out_dir, f"Page {i:05d}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(html)
+        total += len(html.encode("utf-8"))
+    return total
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.corpus import generate_page
+
+
+class MockCodaServer:
+    """Local stand-in for the Coda endpoints the scraper uses
+
+    Serves ``/docs``, ``/docs/{id}``, paginated ``/docs/{id}/pages``, the
+    export endpoints, and the presigned download links they hand out.
+    Latency, 429 responses and the number of pending polls per export are
+    configurable, and per-endpoint request counts are kept in ``stats``.
+    """
+
+    def __init__(self, doc_id="bench-doc", pages=100, latency=0.0, rate_limit=0.0,
+                 retry_after=1, pending_polls=2, page_size=50, paragraphs=40, seed=0):
+        self.doc_id = doc_id
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.pending_polls = pending_polls
+        self.page_size = page_size
+        self.paragraphs = paragraphs
+        self.pages = [
+            {"id": f"canvas-{i:05d}", "type": "page", "name": f"Page {i:05d}",
+             "parent": {"id": "canvas-root", "name": "Root"} if i else None}
+            for i in range(pages)
+        ]
+        self.stats = Counter()
+        self._exports = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server._dispatch(self, "GET")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                server._dispatch(self, "POST")
+
+        return Handler
+
+    def _send(self, handler, status, body, headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json" if not isinstance(body, bytes) else "text/html")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _send_cacheable(self, handler, body):
+        """Send a JSON body with an ETag, answering 304 if the client already has it"""
+        etag = '"%s"' % hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+        if handler.headers.get("If-None-Match") == etag:
+            self.stats["304"] += 1
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        self._send(handler, 200, body, {"ETag": etag})
+
+    def _dispatch(self, handler, method):
+        url = urlparse(handler.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        if path.startswith("/downloads/"):
+            self.stats["download"] += 1
+            return self._download(handler, path.rsplit("/", 1)[1])
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            limited = self._rng.random() < self.rate_limit
+        if limited:
+            self.stats["429"] += 1
+            return self._send(handler, 429, {"message": "Too Many Requests"},
+                              {"Retry-After": str(self.retry_after)})
+
+        match = re.fullmatch(r"/docs/([^/]+)/pages/([^/]+)/export(?:/([^/]+))?", path)
+        if match and method == "POST" and not match.group(3):
+            self.stats["export"] += 1
+            return self._start_export(handler, match.group(2))
+        if match and method == "GET" and match.group(3):
+            self.stats["export_status"] += 1
+            return self._export_status(handler, match.group(3))
+        if path == f"/docs/{self.doc_id}/pages":
+            self.stats["pages"] += 1
+            return self._list_pages(handler, query)
+        if path == f"/docs/{self.doc_id}":
+            self.stats["doc"] += 1
+            return self._send_cacheable(handler, {"id": self.doc_id, "name": "Benchmark doc",
+                                                  "updatedAt": "2025-01-01T00:00:00.000Z"})
+        if path == "/docs":
+            self.stats["docs"] += 1
+            return self._send_cacheable(handler, {"items": [{"id": self.doc_id, "name": "Benchmark doc"}]})
+        self.stats["404"] += 1
+        return self._send(handler, 404, {"message": "Not Found"})
+
+    def _list_pages(self, handler, query):
+        limit = min(int(query.get("limit", [self.page_size])[0]), self.page_size)
+        start = int(query.get("pageToken", ["0"])[0])
+        body = {"items": self.pages[start:start + limit]}
+        if start + limit < len(self.pages):
+            body["nextPageToken"] = str(start + limit)
+        self._send_cacheable(handler, body)
+
+    def _start_export(self, handler, page_id):
+        request_id = str(uuid.uuid4())
+        with self._lock:
+            self._exports[request_id] = {"page_id": page_id, "polls": 0}
+        self._send(handler, 202, {"id": request_id, "requestId": request_id, "status": "inProgress"})
+
+    def _export_status(self, handler, request_id):
+        with self._lock:
+            export = self._exports.get(request_id)
+            if export is None:
+                # Unknown request IDs (e.g. from pages.json) are exported on first sight
+                export = self._exports[request_id] = {"page_id": None, "polls": 0}
+            export["polls"] += 1
+            done = export["polls"] > self.pending_polls
+        if not done:
+            return self._send(handler, 200, {"id": request_id, "status": "inProgress"})
+        signed_at = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        link = f"{self.base_url}/downloads/{request_id}?X-Amz-Date={signed_at}&X-Amz-Expires=300"
+        self._send(handler, 200, {"id": request_id, "status": "complete", "downloadLink": link})
+
+    def _download(self, handler, request_id):
+        rng = random.Random(request_id)
+        html = generate_page(rng, self.paragraphs).encode("utf-8")
+        self._send(handler, 200, html)
@@ -0,0 +1,267 @@
+"""Benchmarks for the converter and the scraper
+
+Examples:
+    python -m benchmarks.run convert --pages 500 --backends soup,stream
+    python -m benchmarks.run scraper --pages 200 --latency 0.05 --rate-limit 0.05
+    python -m benchmarks.run cms --pages 500 --batch-size 25 --latency 0.02
+    python -m benchmarks.run parity --pages 200 --fragments 5000
+    python -m benchmarks.run all --output bench.json --compare previous.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import generate_corpus, random_fragment
+from benchmarks.mock_coda import MockCodaServer
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_convert(args):
+    """Measure convert_html_to_json throughput, per-page latency and peak memory"""
+    from html_converter import convert_html_file, convert_html_to_json
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        html_dir = args.html_dir
+        if html_dir is None:
+            html_dir = os.path.join(tmp, "html_pages")
+            generate_corpus(html_dir, args.pages, args.paragraphs, args.span_density, args.list_depth, args.seed)
+        files = sorted(f for f in os.listdir(html_dir) if f.endswith(".html"))
+        total_bytes = sum(os.path.getsize(os.path.join(html_dir, f)) for f in files)
+
+        for backend in args.backends.split(","):
+            latencies = []
+            for html_file in files:
+                start = time.perf_counter()
+                convert_html_file(os.path.join(html_dir, html_file), backend)
+                latencies.append(time.perf_counter() - start)
+
+            output_file = os.path.join(tmp, f"posts-{backend}.json")
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                convert_html_to_json(html_dir, output_file, workers=args.workers, backend=backend,
+                                     normalize=args.normalize)
+                elapsed = time.perf_counter() - start
+
+                tracemalloc.start()
+                convert_html_to_json(html_dir, output_file, backend=backend, normalize=args.normalize)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            results[backend] = {
+                "pages": len(files),
+                "input_bytes": total_bytes,
+                "output_bytes": os.path.getsize(output_file),
+                "seconds": round(elapsed, 4),
+                "pages_per_second": round(len(files) / elapsed, 2),
+                "mb_per_second": round(total_bytes / elapsed / 1e6, 3),
+                "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 3),
+                "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 3),
+                "latency_max_ms": round(max(latencies) * 1000, 3),
+                "peak_memory_mb": round(peak / 1e6, 3),
+            }
+    return results
+
+
+def bench_scraper(args):
+    """Run the scraper against the local mock Coda API"""
+    from coda_scraper import CodaPageScraper, TokenBucket
+    from downloader import ExportDownloader
+
+    server = MockCodaServer(pages=args.pages, latency=args.latency, rate_limit=args.rate_limit,
+                            retry_after=args.retry_after, pending_polls=args.pending_polls,
+                            paragraphs=args.paragraphs, seed=args.seed)
+    results = {}
+    with server, tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        scraper = CodaPageScraper("bench-token", base_url=server.base_url,
+                                  rate_limiter=TokenBucket(rate=args.rate, capacity=args.rate))
+
+        start = time.perf_counter()
+        page_names = scraper.get_page_names(server.doc_id)
+        results["list_pages_seconds"] = round(time.perf_counter() - start, 4)
+        page_ids = [page["id"] for page in server.pages]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            responses = list(executor.map(lambda page_id: scraper.get_page_content(server.doc_id, page_id),
+                                          page_ids))
+        pages = [[page_id, response["requestId"]] for page_id, response in zip(page_ids, responses)]
+        results["initiate_seconds"] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        links = scraper.get_download_links(server.doc_id, pages, max_workers=args.workers, timeout=args.timeout)
+        results["poll_seconds"] = round(time.perf_counter() - start, 4)
+        results["links"] = len(links)
+
+        # Fresh exports so the download run polls and downloads end to end
+        pages = [[page_id, scraper.get_page_content(server.doc_id, page_id)["requestId"]] for page_id in page_ids]
+        downloader = ExportDownloader(scraper, server.doc_id, os.path.join(tmp, "html_pages"),
+                                      max_workers=args.workers)
+        start = time.perf_counter()
+        paths = downloader.download_exports(pages, page_names, timeout=args.timeout)
+        results["download_seconds"] = round(time.perf_counter() - start, 4)
+        results["downloaded"] = len(paths)
+
+    results["requests"] = dict(server.stats)
+    results["final_rate"] = round(scraper.rate_limiter.rate, 3)
+    return results
+
+
+def bench_cms(args):
+    """Send a converted corpus to the file-backed stand-in CMS"""
+    from cms_sink import CmsSink, FileTarget
+    from html_converter import convert_html_to_json
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        html_dir = args.html_dir
+        if html_dir is None:
+            html_dir = os.path.join(tmp, "html_pages")
+            generate_corpus(html_dir, args.pages, args.paragraphs, args.span_density, args.list_depth, args.seed)
+        posts_file = os.path.join(tmp, "posts.ndjson")
+        convert_html_to_json(html_dir, posts_file, workers=args.workers, output_format="ndjson")
+
+        target = FileTarget(os.path.join(tmp, "cms.json"), latency=args.latency, fail_rate=args.rate_limit,
+                            seed=args.seed)
+        sink = CmsSink(target, os.path.join(tmp, "cms_state.json"), batch_size=args.batch_size,
+                       max_workers=args.workers, base_delay=0.01)
+        start = time.perf_counter()
+        summary = sink.sync_file(posts_file)
+        elapsed = time.perf_counter() - start
+
+        # A second run finds every post unchanged
+        start = time.perf_counter()
+        sink.sync_file(posts_file)
+        results["resync_seconds"] = round(time.perf_counter() - start, 4)
+
+    results.update(summary)
+    results["seconds"] = round(elapsed, 4)
+    results["posts_per_second"] = round(summary["sent"] / elapsed, 2) if elapsed else 0.0
+    results["requests"] = target.requests
+    return results
+
+
+def check_parity(args):
+    """Check that the soup and stream backends give the same posts
+
+    Every corpus page is converted with both backends, with and without
+    normalization, and so are ``--fragments`` random malformed fragments.
+    The first few differing inputs are kept in ``examples``.
+    """
+    import random
+    from html_converter import convert_html_file
+
+    results = {"files": 0, "fragments": 0, "mismatches": 0, "examples": []}
+
+    def check(path, label):
+        for normalize in (False, True):
+            soup = convert_html_file(path, "soup", normalize=normalize)
+            stream = convert_html_file(path, "stream", normalize=normalize)
+            if soup != stream:
+                results["mismatches"] += 1
+                if len(results["examples"]) < 5:
+                    with open(path, encoding="utf-8") as f:
+                        results["examples"].append({"input": label, "html": f.read()[:500],
+                                                    "normalize": normalize})
+                return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        html_dir = args.html_dir
+        if html_dir is None:
+            html_dir = os.path.join(tmp, "html_pages")
+            generate_corpus(html_dir, args.pages, args.paragraphs, args.span_density, args.list_depth, args.seed)
+        for html_file in sorted(f for f in os.listdir(html_dir) if f.endswith(".html")):
+            check(os.path.join(html_dir, html_file), html_file)
+            results["files"] += 1
+
+        rng = random.Random(args.seed)
+        path = os.path.join(tmp, "fragment.html")
+        for i in range(args.fragments):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(random_fragment(rng))
+            check(path, f"fragment {i}")
+            results["fragments"] += 1
+    return results
+
+
+def compare(current, previous, prefix=""):
+    """Print how each numeric result changed from a previous run"""
+    for key, value in current.items():
+        name = f"{prefix}{key}"
+        old = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict):
+            compare(value, old or {}, name + ".")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)):
+            change = (value - old) / old * 100 if old else 0.0
+            print(f"{name:45} {old:>12} -> {value:<12} {change:+.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Coda scraper and HTML converter")
+    parser.add_argument("suite", choices=("convert", "scraper", "cms", "parity", "all"))
+    parser.add_argument("--pages", type=int, default=200, help="Number of pages to generate or export")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Top-level blocks per page")
+    parser.add_argument("--span-density", type=float, default=0.6, help="Chance of each extra span per paragraph")
+    parser.add_argument("--list-depth", type=int, default=1, help="Maximum list nesting")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--html-dir", help="Benchmark an existing directory instead of a generated corpus")
+    parser.add_argument("--backends", default="soup,stream", help="Comma-separated converter backends")
+    parser.add_argument("--normalize", action="store_true", help="Merge text nodes and drop empty fields")
+    parser.add_argument("--workers", type=int, default=4, help="Conversion processes / scraper threads")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock API latency in seconds")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of API calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with 429 responses")
+    parser.add_argument("--pending-polls", type=int, default=2, help="Polls before an export completes")
+    parser.add_argument("--rate", type=float, default=50.0, help="Scraper token-bucket rate (requests/s)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Posts per CMS batch")
+    parser.add_argument("--fragments", type=int, default=2000, help="Random fragments for the parity check")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Polling deadline in seconds")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against the results of an earlier run")
+    args = parser.parse_args(argv)
+
+    results = {"config": vars(args).copy()}
+    if args.suite in ("convert", "all"):
+        results["convert"] = bench_convert(args)
+    if args.suite in ("scraper", "all"):
+        results["scraper"] = bench_scraper(args)
+    if args.suite in ("cms", "all"):
+        results["cms"] = bench_cms(args)
+    if args.suite in ("parity", "all"):
+        results["parity"] = check_parity(args)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        results.pop("config")
+        print(f"\nChanges since {args.compare}:")
+        compare(results, previous)
+
+    # The backends must agree, so a parity failure fails the run
+    if results.get("parity", {}).get("mismatches"):
+        print(f"\nThe soup and stream backends differ on {results['parity']['mismatches']} inputs")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import json
+import time
+import random
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from coda_scraper import backoff_delay, parse_retry_after
+from content_store import doc_hash
+from post_writer import atomic_write, iter_posts
+
+
+class RetryableError(Exception):
+    """A batch failed in a way that is worth retrying (timeout, 429, 5xx)"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class HttpTarget:
+    """A CMS that upserts posts by slug through a batch endpoint
+
+    Each batch is POSTed as ``{"key": "Slug", "posts": [...]}`` with an
+    ``Idempotency-Key`` header, so a batch that is retried after a timeout
+    is applied only once.
+    """
+
+    def __init__(self, base_url: str, api_token: Optional[str] = None, endpoint: str = "/posts/batch",
+                 pool_size: int = 8, timeout: float = 60.0):
+        self.url = base_url.rstrip('/') + endpoint
+        self.timeout = timeout
+
+        # One keep-alive connection pool shared by the sink's worker threads
+        self.session = requests.Session()
+        self.session.headers["Content-Type"] = "application/json"
+        if api_token:
+            self.session.headers["Authorization"] = f"Bearer {api_token}"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def upsert(self, posts: List[Dict[str, Any]], idempotency_key: str) -> Dict[str, Any]:
+        try:
+            response = self.session.post(self.url, json={"key": "Slug", "posts": posts},
+                                         headers={"Idempotency-Key": idempotency_key},
+                                         timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(str(e))
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(f"HTTP {response.status_code}", parse_retry_after(response, None))
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+
+class FileTarget:
+    """Local stand-in for a CMS, keeping posts by slug in a JSON file
+
+    Behaves like ``HttpTarget`` for the sink: batches are upserts, a repeated
+    idempotency key is not applied twice, and ``latency`` / ``fail_rate``
+    simulate a slow or flaky server for tests and benchmarks. Like a real
+    server it only remembers keys for a while: keys older than ``key_ttl``
+    seconds, and the oldest beyond ``max_keys``, are forgotten.
+    """
+
+    def __init__(self, path: str = "cms_posts.json", latency: float = 0.0, fail_rate: float = 0.0,
+                 seed: Optional[int] = None, key_ttl: float = 24 * 3600.0, max_keys: int = 10000):
+        self.path = path
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.key_ttl = key_ttl
+        self.max_keys = max_keys
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.posts = data.get('posts', {})
+        # Idempotency key -> time it was applied
+        applied = data.get('applied', {})
+        if isinstance(applied, list):
+            applied = dict.fromkeys(applied, time.time())
+        self._applied = applied
+
+    def upsert(self, posts: List[Dict[str, Any]], idempotency_key: str) -> Dict[str, Any]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            if self._rng.random() < self.fail_rate:
+                raise RetryableError("simulated failure")
+            if idempotency_key in self._applied:
+                return {"replayed": True, "upserted": 0}
+            for post in posts:
+                self.posts[post['Slug']] = post
+            self._applied[idempotency_key] = time.time()
+            self._expire_keys()
+            self._save()
+        return {"replayed": False, "upserted": len(posts)}
+
+    def _expire_keys(self):
+        """Forget keys older than key_ttl, and the oldest beyond max_keys"""
+        # Keys are kept in the order they were applied
+        cutoff = time.time() - self.key_ttl
+        excess = len(self._applied) - self.max_keys
+        for i, key in enumerate(list(self._applied)):
+            if i >= excess and self._applied[key] >= cutoff:
+                break
+            del self._applied[key]
+
+    def _save(self):
+        with atomic_write(self.path) as f:
+            json.dump({'posts': self.posts, 'applied': self._applied}, f, ensure_ascii=False)
+
+
+class CmsSink:
+    """Upsert converted posts into a CMS in concurrent batches
+
+    Posts are read one at a time, grouped into batches of ``batch_size`` and
+    sent by ``max_workers`` threads. The hash of every post that was sent is
+    kept in ``state_file``; a post whose hash has not changed since it was
+    last sent is skipped.
+    """
+
+    def __init__(self, target=None, state_file: str = "cms_state.json", batch_size: int = 50,
+                 max_workers: int = 4, max_retries: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 30.0, dry_run: bool = False):
+        if target is None and not dry_run:
+            raise ValueError("A target is required unless dry_run is set")
+        self.target = target
+        self.state_file = state_file
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dry_run = dry_run
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict[str, str]:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('sent', {})
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        """Write the hashes of sent posts atomically"""
+        with atomic_write(self.state_file) as f:
+            json.dump({'version': 1, 'sent': self.state}, f, indent=2, ensure_ascii=False)
+
+    def _send(self, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Send one batch, retrying transient failures with the same idempotency key
+
+        The key is new for every submission, so retries of this batch are
+        applied once, but a later run that sends the same contents again
+        (e.g. a post reverted to an earlier version) is applied too.
+        """
+        key = str(uuid.uuid4())
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.target.upsert(batch, key)
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = e.retry_after
+                if delay is None:
+                    delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                print(f"Batch of {len(batch)} posts failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def sync(self, posts: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """Send every new or changed post
+
+        Args:
+            posts: Posts to send, e.g. ``post_writer.iter_posts("posts.json")``
+
+        Returns:
+            Counts of sent, skipped and failed posts and of batches sent
+        """
+        summary = {'sent': 0, 'skipped': 0, 'failed': 0, 'batches': 0}
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                batch, hashes = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    summary['failed'] += len(batch)
+                    print(f"Error sending batch starting at {batch[0]['Slug']}: {e}")
+                    continue
+                summary['sent'] += len(batch)
+                summary['batches'] += 1
+                for post, post_hash in zip(batch, hashes):
+                    self.state[post['Slug']] = post_hash
+
+        def submit(executor, batch, hashes):
+            if self.dry_run:
+                print(f"Would send {len(batch)} posts: {', '.join(post['Slug'] for post in batch)}")
+                summary['sent'] += len(batch)
+                summary['batches'] += 1
+                return
+            # Keep a bounded number of batches in memory
+            if len(pending) >= self.max_workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(self._send, batch)] = (batch, hashes)
+
+        batch, hashes = [], []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for post in posts:
+                    post_hash = doc_hash(post)
+                    if self.state.get(post['Slug']) == post_hash:
+                        summary['skipped'] += 1
+                        continue
+                    batch.append(post)
+                    hashes.append(post_hash)
+                    if len(batch) >= self.batch_size:
+                        submit(executor, batch, hashes)
+                        batch, hashes = [], []
+                if batch:
+                    submit(executor, batch, hashes)
+                collect(list(pending))
+            finally:
+                if not self.dry_run:
+                    self.save_state()
+
+        print(f"Sent {summary['sent']} posts in {summary['batches']} batches, "
+              f"skipped {summary['skipped']} unchanged, {summary['failed']} failed")
+        return summary
+
+    def sync_file(self, posts_file: str = "posts.json") -> Dict[str, int]:
+        """Send the posts of a converter output file (JSON, NDJSON or gzipped)"""
+        return self.sync(iter_posts(posts_file))
@@ -1,16 +1,192 @@
 import requests
 import json
 import time
-from typing import Dict, Any, List
+import heapq
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from requests.adapters import HTTPAdapter
+
+from http_cache import ResponseCache
+from metrics import Metrics
+from page_index import PageIndex
+
+
+# Path segments kept as-is in endpoint names; everything else is an ID
+_ENDPOINT_NAMES = frozenset(('docs', 'pages', 'export'))
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every request of a scraper
+
+    A 429 from Coda halves the refill rate and pauses the bucket for the
+    Retry-After period; successful responses slowly raise the rate back
+    towards the configured maximum.
+    """
+
+    def __init__(self, rate: float = 10.0, capacity: int = 10, min_rate: float = 0.2):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now < self.paused_until:
+            self.updated = now
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Block until a token is available
+
+        Returns:
+            The number of seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def throttle(self, retry_after: float):
+        """Back off after a 429 response"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def reward(self):
+        """Raise the rate again after a successful response"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+def parse_retry_after(response: requests.Response, default: float) -> float:
+    """Read the Retry-After header as seconds, accepting both header formats"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+def link_expires_at(link: str) -> Optional[float]:
+    """Return the expiry time of a presigned S3 link as a Unix timestamp"""
+    query = parse_qs(urlparse(link).query)
+    try:
+        signed_at = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+        expires = int(query['X-Amz-Expires'][0])
+    except (KeyError, ValueError):
+        return None
+    return signed_at.replace(tzinfo=timezone.utc).timestamp() + expires
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with jitter: a random delay in [d/2, d]"""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
 
 class CodaPageScraper:
-    def __init__(self, api_token: str):
+    def __init__(self, api_token: str, rate_limiter: Optional[TokenBucket] = None, max_retries: int = 5,
+                 base_url: str = "https://coda.io/apis/v1", pool_size: int = 10,
+                 cache: Optional[ResponseCache] = None, metrics: Optional[Metrics] = None):
         self.api_token = api_token
-        self.base_url = "https://coda.io/apis/v1"
+        self.base_url = base_url
         self.headers = {
             "Authorization": f"Bearer {api_token}",
             "Content-Type": "application/json"
         }
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.max_retries = max_retries
+        self.cache = cache if cache is not None else ResponseCache()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._page_indexes = {}
+
+        # One keep-alive connection pool for every API call
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _endpoint(self, method: str, url: str) -> str:
+        """Name an API call for metrics, e.g. "GET /docs/{id}/pages" """
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else urlparse(url).path
+        segments = [segment if segment in _ENDPOINT_NAMES else '{id}'
+                    for segment in path.split('?')[0].strip('/').split('/') if segment]
+        return f"{method} /{'/'.join(segments)}"
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request through the shared rate limiter, retrying on 429"""
+        endpoint = self._endpoint(method, url)
+        for attempt in range(self.max_retries + 1):
+            waited = self.rate_limiter.acquire()
+            if waited:
+                self.metrics.inc('coda_rate_limited_seconds_total', waited, endpoint=endpoint)
+            start = time.perf_counter()
+            response = self.session.request(method, url, **kwargs)
+            self.metrics.observe('coda_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+            self.metrics.inc('coda_responses_total', endpoint=endpoint, status=response.status_code)
+            if response.status_code != 429 or attempt == self.max_retries:
+                break
+            self.metrics.inc('coda_retries_total', endpoint=endpoint)
+            retry_after = parse_retry_after(response, default=2 ** attempt)
+            print(f"Rate limited by Coda, retrying in {retry_after:.1f}s")
+            self.rate_limiter.throttle(retry_after)
+        if response.ok:
+            self.rate_limiter.reward()
+        return response
+
+    def _get_cached(self, url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """GET a JSON resource through the response cache
+
+        A fresh cached response is returned without a request; a stale one
+        is revalidated with If-None-Match / If-Modified-Since.
+        """
+        key = self.cache.key(url, params, self.api_token)
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.metrics.inc('coda_cache_total', result='hit')
+            return entry.data
+
+        headers = entry.validators() if entry is not None else {}
+        response = self._request('GET', url, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.metrics.inc('coda_cache_total', result='revalidated')
+            self.cache.touch(key, entry)
+            return entry.data
+        self.metrics.inc('coda_cache_total', result='miss')
+        response.raise_for_status()
+        data = response.json()
+        self.cache.put(key, data, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                       len(response.content))
+        return data
 
     def get_doc(self, doc_id: str) -> Dict[str, Any]:
         """Get a specific document by ID"""
@@ -18,9 +194,7 @@ class CodaPageScraper:
             'isOwner': True,
             'query': 'New'
         }
-        response = requests.get(f"{self.base_url}/docs/{doc_id}", headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json()
+        return self._get_cached(f"{self.base_url}/docs/{doc_id}", params)
 
     def get_all_docs(self, query_params: Dict[str, Any] = None) -> Dict[str, Any]:
         """Get documents with optional filtering"""
@@ -28,96 +202,323 @@ class CodaPageScraper:
             'isOwner': True,
             'query': 'New'
         }
-        response = requests.get(f"{self.base_url}/docs", headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json()
+        return self._get_cached(f"{self.base_url}/docs", params)
+
+    def _get_pages_page(self, doc_id: str, limit: int, page_token: Optional[str]) -> Dict[str, Any]:
+        params = {'limit': limit}
+        if page_token:
+            params['pageToken'] = page_token
+        return self._get_cached(f"{self.base_url}/docs/{doc_id}/pages", params)
+
+    def iter_doc_pages(self, doc_id: str, limit: int = 100) -> Iterator[Dict[str, Any]]:
+        """Iterate over every page of a document, following nextPageToken
+
+        The request for the next page of results is sent as soon as its
+        token arrives, so it is in flight while the caller handles the
+        current one.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._get_pages_page, doc_id, limit, None)
+            while future is not None:
+                result = future.result()
+                next_token = result.get('nextPageToken')
+                future = executor.submit(self._get_pages_page, doc_id, limit, next_token) if next_token else None
+                yield from result.get('items', [])
 
     def get_all_doc_pages(self, doc_id: str) -> Dict[str, Any]:
         """Get all pages of a document"""
-        response = requests.get(f"{self.base_url}/docs/{doc_id}/pages", headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+        return {'items': list(self.iter_doc_pages(doc_id))}
+
+    def get_page_index(self, doc_id: str, cache_file: Optional[str] = None, max_age: float = 3600.0,
+                       refresh: bool = False) -> PageIndex:
+        """Get an index of the document's page tree
+
+        The index is kept for the lifetime of the scraper and, with
+        ``cache_file``, on disk. A disk cache is used while it is younger
+        than ``max_age`` and was written for the doc's current ``updatedAt``.
+        """
+        if not refresh and doc_id in self._page_indexes:
+            return self._page_indexes[doc_id]
+
+        index = None
+        updated_at = None
+        if cache_file and not refresh:
+            updated_at = self.get_doc(doc_id).get('updatedAt')
+            index = PageIndex.load(cache_file, max_age, updated_at)
+            if index is not None:
+                print(f"Loaded {len(index)} pages from {cache_file}")
+        if index is None:
+            index = PageIndex(self.iter_doc_pages(doc_id))
+            if cache_file:
+                if updated_at is None:
+                    updated_at = self.get_doc(doc_id).get('updatedAt')
+                index.save(cache_file, updated_at)
+
+        self._page_indexes[doc_id] = index
+        return index
+
+    def get_page_names(self, doc_id: str) -> Dict[str, str]:
+        """Map page IDs of a document to their names"""
+        return {page['id']: page.get('name', page['id'])
+                for page in self.get_page_index(doc_id)}
 
     def get_page_content(self, doc_id: str, page_id: str) -> Dict[str, Any]:
         """Get the content of a page"""
-        uri = f'https://coda.io/apis/v1/docs/{doc_id}/pages/{page_id}/export'
+        uri = f'{self.base_url}/docs/{doc_id}/pages/{page_id}/export'
         payload = {
         'outputFormat': 'html',
         }
-        req = requests.post(uri, headers=self.headers, json=payload)
+        req = self._request('POST', uri, json=payload)
         req.raise_for_status() # Throw if there was an error.
         res = req.json()
         return res
 
     def get_export_status(self, doc_id: str, page_id: str, request_id: str) -> Dict[str, Any]:
         """Get the export status of a page"""
-        uri = f'https://coda.io/apis/v1/docs/{doc_id}/pages/{page_id}/export/{request_id}'
-        req = requests.get(uri, headers=self.headers)
+        uri = f'{self.base_url}/docs/{doc_id}/pages/{page_id}/export/{request_id}'
+        req = self._request('GET', uri)
         req.raise_for_status() # Throw if there was an error.
         return req.json()
     
-    def get_download_links(self, doc_id: str, pages: List) -> List[str]:
-        """Get download links for a list of pages
-        
+    def _check_export(self, doc_id: str, index: int, total: int, page: List) -> Optional[str]:
+        """Check the export status of one [page_id, request_id] pair
+
+        Returns:
+            The download link, or None if the export is not complete
+        """
+        page_id = page[0]
+        request_id = page[1]
+
+        print(f"Checking page {index+1}/{total} (ID: {page_id})...")
+
+        try:
+            # Get export status
+            content = self.get_export_status(doc_id, page_id, request_id)
+
+            if content['status'] == 'complete':
+                download_link = content['downloadLink']
+                print(f"Found download link: {download_link}")
+                return download_link
+            print(f"Page {page_id} export status: {content['status']}")
+        except Exception as e:
+            print(f"Error checking page {page_id}: {e}")
+        return None
+
+    def poll_exports(self, doc_id: str, pages, max_workers: int = 4, timeout: float = 600.0,
+                     base_delay: float = 1.0, max_delay: float = 30.0,
+                     max_errors: int = 3) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """Poll pending exports until each one is complete or failed
+
+        Pending exports wait in a priority queue ordered by their next poll
+        time, and each is re-polled with its own exponential backoff and
+        jitter. Results are yielded as soon as an export finishes, so fast
+        pages never wait for the slowest one.
+
         Args:
             doc_id: The document ID
-            pages: A list of [page_id, request_id] pairs
-            
-        Returns:
-            A list of download links
+            pages: A list of [page_id, request_id] pairs, or a ``queue.Queue``
+                that pairs are put on while polling runs, ended with None
+            max_workers: Number of status checks in flight at once
+            timeout: Global deadline in seconds for the whole batch
+            base_delay: Delay before the second poll of an export
+            max_delay: Upper bound on the delay between polls
+            max_errors: Consecutive request errors before giving up on a page
+
+        Yields:
+            (page_id, request_id, content) tuples. ``content`` is the last
+            status response, ``{'status': 'timeout'}`` for exports still
+            pending at the deadline or ``{'status': 'error', 'error': ...}``
+            after repeated request errors.
         """
-        download_links = []
-        
-        for i, page in enumerate(pages):
-            page_id = page[0]
-            request_id = page[1]
-            
-            print(f"Checking page {i+1}/{len(pages)} (ID: {page_id})...")
-            
+        deadline = time.monotonic() + timeout
+        feed = None
+        if isinstance(pages, queue.Queue):
+            feed, pages = pages, []
+        # (next poll time, index, attempt, consecutive errors)
+        heap = [(0.0, i, 0, 0) for i in range(len(pages))]
+        heapq.heapify(heap)
+        in_flight = {}
+        stop = threading.Event()
+
+        def next_page():
+            # Wakes up now and then so that polling can end at the deadline
+            while not stop.is_set():
+                try:
+                    return feed.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+            return False
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=1) as reader:
             try:
-                # Get export status
-                content = self.get_export_status(doc_id, page_id, request_id)
-                
+                arrival = reader.submit(next_page) if feed is not None else None
+                while heap or in_flight or arrival is not None:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        break
+
+                    while heap and heap[0][0] <= now and len(in_flight) < max_workers:
+                        _, i, attempt, errors = heapq.heappop(heap)
+                        page_id, request_id = pages[i][0], pages[i][1]
+                        future = executor.submit(self.get_export_status, doc_id, page_id, request_id)
+                        in_flight[future] = (i, attempt, errors)
+
+                    wait_for = deadline - now
+                    if heap and len(in_flight) < max_workers:
+                        wait_for = min(wait_for, max(0.0, heap[0][0] - now))
+                    waiting = set(in_flight)
+                    if arrival is not None:
+                        waiting.add(arrival)
+                    if not waiting:
+                        time.sleep(wait_for)
+                        continue
+
+                    done, _ = wait(waiting, timeout=wait_for, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future is arrival:
+                            page = arrival.result()
+                            arrival = None
+                            if page is not None:
+                                pages.append(page)
+                                heapq.heappush(heap, (0.0, len(pages) - 1, 0, 0))
+                                arrival = reader.submit(next_page)
+                            continue
+
+                        i, attempt, errors = in_flight.pop(future)
+                        page_id, request_id = pages[i][0], pages[i][1]
+                        try:
+                            content = future.result()
+                        except Exception as e:
+                            if errors + 1 >= max_errors:
+                                yield page_id, request_id, {'status': 'error', 'error': str(e)}
+                                continue
+                            content, errors = None, errors + 1
+                        else:
+                            errors = 0
+
+                        if content is not None and content.get('status') in ('complete', 'failed'):
+                            yield page_id, request_id, content
+                            continue
+                        next_poll = time.monotonic() + backoff_delay(attempt, base_delay, max_delay)
+                        heapq.heappush(heap, (next_poll, i, attempt + 1, errors))
+
+                for future in in_flight:
+                    future.cancel()
+                pending = sorted([entry[1] for entry in heap] + [entry[0] for entry in in_flight.values()])
+                for i in pending:
+                    yield pages[i][0], pages[i][1], {'status': 'timeout'}
+
+                # Pages that arrive after the deadline time out too
+                if arrival is not None:
+                    stop.set()
+                    page = arrival.result()
+                    while page is not None:
+                        if page is not False:
+                            yield page[0], page[1], {'status': 'timeout'}
+                        page = feed.get()
+            finally:
+                # Let the reader thread finish, even if the caller stops early
+                stop.set()
+
+    def _find_download_links(self, doc_id: str, pages: List, max_workers: int,
+                             timeout: Optional[float]) -> List[Optional[str]]:
+        """Look up download links, returning one entry (or None) per page"""
+        if timeout is not None:
+            found = {}
+            for page_id, request_id, content in self.poll_exports(doc_id, pages, max(1, max_workers), timeout):
                 if content['status'] == 'complete':
-                    download_link = content['downloadLink']
-                    download_links.append(download_link)
-                    print(f"Found download link: {download_link}")
+                    found[(page_id, request_id)] = content['downloadLink']
+                    print(f"Found download link: {content['downloadLink']}")
+                elif content['status'] == 'error':
+                    print(f"Error checking page {page_id}: {content['error']}")
                 else:
                     print(f"Page {page_id} export status: {content['status']}")
-            except Exception as e:
-                print(f"Error checking page {page_id}: {e}")
+            return [found.get((page[0], page[1])) for page in pages]
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(
+                    lambda item: self._check_export(doc_id, item[0], len(pages), item[1]),
+                    enumerate(pages)))
+
+        download_links = []
+        
+        for i, page in enumerate(pages):
+            download_links.append(self._check_export(doc_id, i, len(pages), page))
             
             # Small delay between requests
             time.sleep(1)
             
         return download_links
+
+    def get_download_links(self, doc_id: str, pages: List, max_workers: int = 1,
+                           timeout: Optional[float] = None, journal=None) -> List[str]:
+        """Get download links for a list of pages
+        
+        Args:
+            doc_id: The document ID
+            pages: A list of [page_id, request_id] pairs
+            max_workers: Number of concurrent status checks. With more than
+                one worker, pacing is left to the shared rate limiter
+                instead of a fixed delay between requests.
+            timeout: If set, keep re-polling pending exports (see
+                ``poll_exports``) for up to this many seconds instead of
+                checking each one once
+            journal: Optional ExportJournal. Pages it records as downloaded
+                are skipped, journaled links that have not expired are
+                reused, and new links are recorded.
+            
+        Returns:
+            A list of download links, in the order of ``pages``
+        """
+        if journal is None:
+            return [link for link in self._find_download_links(doc_id, pages, max_workers, timeout) if link]
+
+        links = {}
+        remaining = []
+        for page in pages:
+            entry = journal.get(page[0])
+            if entry and entry.get('request_id') == page[1]:
+                if entry['state'] == 'downloaded':
+                    print(f"Page {page[0]} already downloaded, skipping")
+                    continue
+                link = journal.link(page[0], page[1])
+                if link:
+                    links[page[0]] = link
+                    continue
+            remaining.append(page)
+
+        for page, link in zip(remaining, self._find_download_links(doc_id, remaining, max_workers, timeout)):
+            if link:
+                links[page[0]] = link
+                journal.completed(page[0], page[1], link)
+
+        return [links[page[0]] for page in pages if page[0] in links]
     
-    def filter_pages_by_parent(self, doc_id: str, parent_name: str) -> List:
+    def filter_pages_by_parent(self, doc_id: str, parent_name: str, recursive: bool = False,
+                               cache_file: Optional[str] = None) -> List:
         """Get all pages with a specific parent name
         
         Args:
             doc_id: The document ID
             parent_name: The name of the parent page
+            recursive: Include every page below the parent, not only its children
+            cache_file: Optional on-disk cache for the page index
             
         Returns:
             A list of page IDs
         """
-        all_pages = self.get_all_doc_pages(doc_id)
-        filtered_pages = []
-        
-        for page in all_pages.get('items', []):
-            if page.get('parent') is not None:
-                if page['parent'].get('name') == parent_name:
-                    filtered_pages.append(page['id'])
-        
-        return filtered_pages
+        return self.get_page_index(doc_id, cache_file).under(parent_name, recursive)
     
-    def initiate_exports(self, doc_id: str, page_ids: List[str]) -> List:
+    def initiate_exports(self, doc_id: str, page_ids: List[str], journal=None) -> List:
         """Initiate exports for a list of pages
         
         Args:
             doc_id: The document ID
             page_ids: A list of page IDs
+            journal: Optional ExportJournal; pages it already has a request
+                ID for are not exported again
             
         Returns:
             A list of [page_id, request_id] pairs
@@ -125,10 +526,17 @@ class CodaPageScraper:
         export_requests = []
         
         for page_id in page_ids:
+            request_id = journal.request_id(page_id) if journal is not None else None
+            if request_id:
+                export_requests.append([page_id, request_id])
+                print(f"Export for page {page_id} already initiated, request ID: {request_id}")
+                continue
             try:
                 export_response = self.get_page_content(doc_id, page_id)
                 request_id = export_response.get('requestId')
                 export_requests.append([page_id, request_id])
+                if journal is not None:
+                    journal.initiated(page_id, request_id)
                 print(f"Initiated export for page {page_id}, request ID: {request_id}")
                 time.sleep(1)  # Small delay between requests
             except Exception as e:
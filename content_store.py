@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from post_writer import atomic_write
+
+# How duplicate pages are resolved
+DUPLICATE_POLICIES = ("first", "newest", "all")
+
+# Browsers and the downloader name repeated downloads "Page (1).html"
+_COPY_SUFFIX = re.compile(r' \(\d+\)$')
+
+
+def sha256_file(path: str) -> str:
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def doc_hash(doc: Any) -> str:
+    """Hash a converted doc by its canonical JSON"""
+    canonical = json.dumps(doc, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ContentStore:
+    """Content-addressed store of converted docs, keyed by the HTML's SHA-256
+
+    A page whose HTML has been converted before, under any file name or in
+    any earlier run, is served from the store instead of being parsed
+    again. Entries are small JSON files written atomically, so worker
+    processes can share one store directory.
+    """
+
+    def __init__(self, store_dir: str = ".content_store"):
+        self.store_dir = store_dir
+        self._memory = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir, exist_ok=True)
+
+    def _path(self, html_hash: str) -> str:
+        return os.path.join(self.store_dir, html_hash[:2], html_hash + '.json')
+
+    def get(self, html_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the stored ``{'doc': ..., 'doc_hash': ...}`` for an HTML hash"""
+        with self._lock:
+            entry = self._memory.get(html_hash)
+        if entry is not None:
+            return entry
+        try:
+            with open(self._path(html_hash), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._memory[html_hash] = entry
+        return entry
+
+    def put(self, html_hash: str, doc: Any) -> Dict[str, Any]:
+        entry = {'doc': doc, 'doc_hash': doc_hash(doc)}
+        path = self._path(html_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            json.dump(entry, f, ensure_ascii=False)
+        with self._lock:
+            self._memory[html_hash] = entry
+        return entry
+
+
+def base_title(title: str) -> str:
+    """Strip the " (1)" that marks a repeated download of the same page"""
+    return _COPY_SUFFIX.sub('', title)
+
+
+def find_duplicates(files: List[Tuple[str, str, str, Optional[str]]]) -> List[List[int]]:
+    """Group files that are the same page
+
+    Files are duplicates if their HTML is identical, their converted docs
+    are identical (e.g. exports that differ only in markup that the
+    converter drops), or their titles give the same slug once a " (n)"
+    copy suffix is removed.
+
+    Args:
+        files: (title, slug_of_base_title, html_hash, doc_hash) per file;
+            doc_hash is None when the file's doc is not known yet
+
+    Returns:
+        Groups of two or more indices into ``files``, in file order
+    """
+    parent = list(range(len(files)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    first_seen = {}
+    for i, (_, slug, html_hash, converted_hash) in enumerate(files):
+        keys = [('slug', slug), ('html', html_hash)]
+        if converted_hash is not None:
+            keys.append(('doc', converted_hash))
+        for key in keys:
+            if key in first_seen:
+                parent[find(i)] = find(first_seen[key])
+            else:
+                first_seen[key] = i
+
+    groups = {}
+    for i in range(len(files)):
+        groups.setdefault(find(i), []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def unique_slugs(slugs: List[str]) -> List[str]:
+    """Number repeated slugs: foo, foo-2, foo-3"""
+    taken = set(slugs)
+    seen = set()
+    result = []
+    for slug in slugs:
+        if slug in seen:
+            n = 2
+            while f"{slug}-{n}" in taken:
+                n += 1
+            slug = f"{slug}-{n}"
+            taken.add(slug)
+        seen.add(slug)
+        result.append(slug)
+    return result
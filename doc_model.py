@@ -0,0 +1,103 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+_FONT_SIZE = re.compile(r'font-size:\s*([^;]+)')
+
+
+class Mark(dict):
+    """An immutable mark, shared by every text node with the same formatting
+
+    Marks are plain dicts to ``json`` and to ``==``, so the output does not
+    change, but one object is reused for all text with the same tag and
+    style. Mutating a shared mark would change every node that uses it, so
+    mutation raises ``TypeError``.
+    """
+
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Mark objects are shared and cannot be modified")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.items())))
+
+    def __reduce__(self):
+        # The default dict pickling refills the object with __setitem__
+        return (Mark, (dict(self),))
+
+
+BOLD = Mark(type="bold")
+ITALIC = Mark(type="italic")
+UNDERLINE = Mark(type="underline")
+
+
+@lru_cache(maxsize=1024)
+def resolve_marks(name: str, style: str) -> Tuple[Mark, ...]:
+    """Return the marks for an element's tag name and inline style
+
+    Pages use only a handful of distinct styles, so each one is parsed once.
+    """
+    marks = []
+
+    # Check for bold text
+    if name == 'strong' or name == 'b' or 'font-weight: bold' in style:
+        marks.append(BOLD)
+
+    # Check for italic text
+    if name == 'em' or name == 'i' or 'font-style: italic' in style:
+        marks.append(ITALIC)
+
+    # Check for underline
+    if name == 'u' or 'text-decoration: underline' in style:
+        marks.append(UNDERLINE)
+
+    # Check for font size
+    font_size_match = _FONT_SIZE.search(style)
+    if font_size_match:
+        size = font_size_match.group(1).strip()
+        marks.append(Mark(type="textStyle", attrs=Mark(fontSize=size)))
+
+    return tuple(marks)
+
+
+def normalize_nodes(nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Return a compact copy of a list of doc nodes
+
+    Adjacent text nodes with the same marks are merged into one, empty text
+    nodes are dropped, and empty ``attrs``, ``content`` and ``marks`` fields
+    are left out. The input is not modified.
+    """
+    result = []
+    for node in nodes:
+        if node.get('type') == 'text':
+            if not node.get('text'):
+                continue
+            marks = node.get('marks') or None
+            previous = result[-1] if result else None
+            if previous is not None and previous['type'] == 'text' and previous.get('marks') == marks:
+                previous['text'] += node['text']
+                continue
+            text_node = {"type": "text", "text": node['text']}
+            if marks:
+                text_node['marks'] = marks
+            result.append(text_node)
+            continue
+
+        compact = {}
+        for key, value in node.items():
+            if key == 'content':
+                value = normalize_nodes(value)
+            if isinstance(value, (dict, list)) and not value:
+                continue
+            compact[key] = value
+        result.append(compact)
+    return result
+
+
+def count_nodes(nodes: List[Dict[str, Any]]) -> int:
+    """Count the nodes of a doc, at every depth"""
+    return sum(1 + count_nodes(node.get('content', ())) for node in nodes)
@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from coda_scraper import CodaPageScraper, link_expires_at
+from export_journal import ExportJournal
+from post_writer import create_temp_file
+
+
+class LinkExpiredError(Exception):
+    """Raised when a presigned export link is no longer valid"""
+
+
+def safe_filename(name: str) -> str:
+    """Turn a page name into a file name usable on every platform"""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '-', name).strip().rstrip('.')
+    return name or 'untitled'
+
+
+class ExportDownloader:
+    """Stream completed exports straight into html_pages
+
+    Presigned links only live for a few minutes, so each export is
+    downloaded as soon as its status turns complete, and an expired link is
+    replaced by asking ``get_export_status`` again. With ``dedupe``, an
+    export whose bytes match a file already written in the run is not kept
+    a second time; the page maps to the existing file.
+    """
+
+    def __init__(self, scraper: CodaPageScraper, doc_id: str, html_dir: str = "html_pages",
+                 max_workers: int = 4, chunk_size: int = 64 * 1024, max_refreshes: int = 2,
+                 expiry_margin: float = 10.0, journal: Optional[ExportJournal] = None,
+                 dedupe: bool = False):
+        self.scraper = scraper
+        self.doc_id = doc_id
+        self.html_dir = html_dir
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_refreshes = max_refreshes
+        self.expiry_margin = expiry_margin
+        self.journal = journal
+        self.dedupe = dedupe
+        self.links = {}
+
+        # One keep-alive session shared by all download threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._reserved = set()
+        # SHA-256 -> path of every file written or kept in this run
+        self._hashes = {}
+
+    def reserve_path(self, path: str):
+        """Keep a file that is already in place from being reused for another page"""
+        with self._lock:
+            self._reserved.add(os.path.basename(path))
+
+    def target_path(self, page_name: str) -> str:
+        """Reserve a file path for a page, numbering repeated names like a browser does"""
+        base = safe_filename(page_name)
+        with self._lock:
+            name = f"{base}.html"
+            n = 1
+            while name in self._reserved:
+                name = f"{base} ({n}).html"
+                n += 1
+            self._reserved.add(name)
+        return os.path.join(self.html_dir, name)
+
+    def _fresh_link(self, page_id: str, request_id: str) -> str:
+        content = self.scraper.get_export_status(self.doc_id, page_id, request_id)
+        if content['status'] != 'complete':
+            raise RuntimeError(f"export status is {content['status']}")
+        return content['downloadLink']
+
+    def _stream_to_file(self, link: str, path: str) -> str:
+        """Stream a link into ``path`` via a temp file and an atomic rename
+
+        Returns:
+            The SHA-256 of the written content
+        """
+        expires_at = link_expires_at(link)
+        if expires_at is not None and time.time() > expires_at - self.expiry_margin:
+            raise LinkExpiredError(link)
+
+        with self.session.get(link, stream=True, timeout=(10, 60)) as response:
+            # S3 answers an expired presigned URL with 403 AccessDenied
+            if response.status_code == 403:
+                raise LinkExpiredError(link)
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            fd, tmp_path = create_temp_file(path, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return digest.hexdigest()
+
+    def download(self, page_id: str, request_id: str, page_name: str, link: Optional[str] = None) -> str:
+        """Download one export, re-requesting its link if it has expired
+
+        Returns:
+            The path of the written HTML file
+        """
+        path = self.target_path(page_name)
+        for attempt in range(self.max_refreshes + 1):
+            if link is None:
+                link = self._fresh_link(page_id, request_id)
+            try:
+                sha256 = self._stream_to_file(link, path)
+                if self.dedupe:
+                    path = self._keep_unique(path, sha256)
+                self.links[page_id] = link
+                if self.journal is not None:
+                    self.journal.downloaded(page_id, path, sha256)
+                return path
+            except LinkExpiredError:
+                if attempt == self.max_refreshes:
+                    raise
+                print(f"Download link for page {page_id} expired, requesting a new one")
+                link = None
+        return path
+
+    def _keep_unique(self, path: str, sha256: str) -> str:
+        """Drop a download whose content is already on disk, returning the path to use"""
+        with self._lock:
+            existing = self._hashes.setdefault(sha256, path)
+            if existing == path:
+                return path
+            self._reserved.discard(os.path.basename(path))
+        os.remove(path)
+        print(f"{os.path.basename(path)} is identical to {existing}, keeping one copy")
+        return existing
+
+    def download_exports(self, pages: List, page_names: Optional[Dict[str, str]] = None,
+                         timeout: float = 600.0) -> Dict[str, str]:
+        """Download exports as soon as each one completes
+
+        Args:
+            pages: A list of [page_id, request_id] pairs
+            page_names: Page ID to name mapping, fetched from the doc if omitted
+            timeout: Deadline for the exports to finish rendering
+
+        Returns:
+            A mapping of page ID to the written file path
+        """
+        if not os.path.exists(self.html_dir):
+            os.makedirs(self.html_dir)
+
+        paths = {}
+        links = {}
+        if self.journal is not None:
+            # Pages whose file from an earlier run is still intact need no API calls,
+            # and pages with an unexpired journaled link need no polling
+            remaining = []
+            for page in pages:
+                path = self.journal.downloaded_path(page[0])
+                if path and self.journal.request_id(page[0]) == page[1]:
+                    paths[page[0]] = path
+                    self.reserve_path(path)
+                    self._hashes.setdefault(self.journal.get(page[0])['sha256'], path)
+                    print(f"Page {page[0]} already downloaded to {path}, skipping")
+                    continue
+                link = self.journal.link(page[0], page[1], self.expiry_margin)
+                if link:
+                    links[page[0]] = (page[1], link)
+                else:
+                    remaining.append(page)
+            pages = remaining
+        if not pages and not links:
+            return paths
+
+        if page_names is None:
+            page_names = self.scraper.get_page_names(self.doc_id)
+
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for page_id, (request_id, link) in links.items():
+                print(f"Reusing the journaled download link of page {page_id}")
+                futures[page_id] = executor.submit(
+                    self.download, page_id, request_id, page_names.get(page_id, page_id), link)
+
+            for page_id, request_id, content in self.scraper.poll_exports(
+                    self.doc_id, pages, self.max_workers, timeout):
+                if content['status'] != 'complete':
+                    print(f"Page {page_id} export status: {content['status']}")
+                    # A failed or unreachable export (e.g. expired, 404) is requested
+                    # again by the next run; a pending one is polled again
+                    if content['status'] in ('failed', 'error') and self.journal is not None:
+                        self.journal.failed(page_id, request_id)
+                    continue
+                if self.journal is not None:
+                    self.journal.completed(page_id, request_id, content['downloadLink'])
+                name = page_names.get(page_id, page_id)
+                futures[page_id] = executor.submit(
+                    self.download, page_id, request_id, name, content['downloadLink'])
+
+        for page_id, future in futures.items():
+            try:
+                paths[page_id] = future.result()
+                print(f"Downloaded page {page_id} to {paths[page_id]}")
+            except Exception as e:
+                print(f"Error downloading page {page_id}: {e}")
+        return paths
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, Any, Optional
+
+from coda_scraper import link_expires_at
+from content_store import sha256_file
+
+
+class ExportJournal:
+    """Append-only, crash-safe record of each page's export progress
+
+    Every state change is appended as one JSON line and fsynced, so a crash
+    loses at most the line being written. On startup the journal is replayed
+    to rebuild the latest state of every page; a torn last line is cut off.
+    """
+
+    def __init__(self, path: str = "exports.jsonl"):
+        self.path = path
+        self.pages = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            # Cut off a torn last line, so the next entry starts on a line of its own
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+                print(f"Dropped an incomplete last line from {self.path}")
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(entry)
+        print(f"Loaded export journal {self.path} with {len(self.pages)} pages")
+
+    def _apply(self, entry: Dict[str, Any]):
+        page = self.pages.setdefault(entry['page_id'], {})
+        # A new export request starts the page over
+        if entry['state'] == 'initiated':
+            page.clear()
+        page.update(entry)
+
+    def record(self, page_id: str, state: str, **fields):
+        """Append a state change for a page"""
+        entry = {'page_id': page_id, 'state': state, 'time': time.time(), **fields}
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(entry)
+
+    def initiated(self, page_id: str, request_id: str):
+        self.record(page_id, 'initiated', request_id=request_id)
+
+    def completed(self, page_id: str, request_id: str, link: str):
+        self.record(page_id, 'completed', request_id=request_id, link=link)
+
+    def downloaded(self, page_id: str, path: str, sha256: str):
+        self.record(page_id, 'downloaded', path=path, sha256=sha256)
+
+    def failed(self, page_id: str, request_id: str):
+        self.record(page_id, 'failed', request_id=request_id)
+
+    def get(self, page_id: str) -> Optional[Dict[str, Any]]:
+        """Return the latest state of a page, or None if it is not journaled"""
+        with self.lock:
+            page = self.pages.get(page_id)
+            return dict(page) if page else None
+
+    def request_id(self, page_id: str) -> Optional[str]:
+        """Return the export request of a page, unless that export failed"""
+        page = self.get(page_id)
+        if not page or page['state'] == 'failed':
+            return None
+        return page.get('request_id')
+
+    def link(self, page_id: str, request_id: str, margin: float = 0.0) -> Optional[str]:
+        """Return the journaled download link of an export request if it has not expired
+
+        Args:
+            margin: Seconds of validity the link must have left
+        """
+        page = self.get(page_id)
+        if not page or page['state'] != 'completed' or page.get('request_id') != request_id:
+            return None
+        expires_at = link_expires_at(page['link'])
+        if expires_at is None or expires_at - margin <= time.time():
+            return None
+        return page['link']
+
+    def downloaded_path(self, page_id: str) -> Optional[str]:
+        """Return the downloaded file of a page if it is still on disk unchanged"""
+        page = self.get(page_id)
+        if not page or page['state'] != 'downloaded' or not os.path.exists(page['path']):
+            return None
+        if sha256_file(page['path']) != page['sha256']:
+            return None
+        return page['path']
@@ -1,15 +1,52 @@
 import os
 import json
 import re
-from bs4 import BeautifulSoup
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial, lru_cache
 
+from content_store import ContentStore, DUPLICATE_POLICIES, base_title, find_duplicates, sha256_file, unique_slugs
+from doc_model import count_nodes, normalize_nodes, resolve_marks
+from metrics import NODE_BUCKETS
+from post_store import PostStoreWriter, index_path
+from post_writer import PostWriter, atomic_write, iter_posts
 
-def convert_html_to_json(html_dir="html_pages", output_file="posts.json"):
+_TEXT_ALIGN = re.compile(r'text-align:\s*([^;]+)')
+
+
+def convert_html_to_json(html_dir="html_pages", output_file="posts.json", incremental=False, manifest_file=None,
+                         workers=1, chunksize=None, backend="soup", output_format="json", compress=None,
+                         dedupe=None, store_dir=None, normalize=False, metrics=None, store_file=None):
     """Convert HTML files in html_pages directory to JSON format
     
     Args:
         html_dir (str): Directory containing HTML files
         output_file (str): Output JSON file path
+        incremental (bool): Only re-parse HTML files that are new or changed
+            since the last run, reusing the other posts from ``output_file``
+        manifest_file (str): Manifest of per-file sizes and content hashes
+            used by incremental mode (defaults to ``<output>.manifest.json``)
+        workers (int): Number of processes to convert files with
+        chunksize (int): Files handed to a worker process at a time
+            (defaults to spreading the files about four chunks per worker)
+        backend (str): HTML backend, "soup" or "stream" (see convert_html_file)
+        output_format (str): "json" (indented array), "json-compact" or
+            "ndjson"; posts are written as soon as they are converted
+        compress (bool): Gzip the output (defaults to True for ``.gz`` paths)
+        dedupe (str): How to handle duplicate pages (same HTML, or the same
+            slug once a " (1)" copy suffix is removed): "first" keeps the
+            original (the first file without a copy suffix), "newest" the most recently modified one, "all" keeps
+            every page with unique slugs. None (default) does not check.
+        store_dir (str): Content-addressed store of converted docs; pages
+            whose HTML was converted before are not parsed again
+        normalize (bool): Merge adjacent text nodes with the same marks and
+            leave out empty fields (see doc_model.normalize_nodes)
+        metrics (Metrics): Record parse time, node count and bytes in and
+            out for every file (see metrics.py)
+        store_file (str): Also write the posts to an indexed store here
+            (NDJSON records plus a ``.idx`` file, see post_store.py) for
+            lookups by slug or title without loading the whole output
     
     Returns:
         int: Number of posts converted
@@ -19,8 +56,8 @@ def convert_html_to_json(html_dir="html_pages", output_file="posts.json"):
         print(f"Directory {html_dir} does not exist!")
         return 0
     
-    # Get all HTML files
-    html_files = [f for f in os.listdir(html_dir) if f.endswith('.html')]
+    # Get all HTML files, sorted so the output order does not depend on the file system
+    html_files = sorted(f for f in os.listdir(html_dir) if f.endswith('.html'))
     
     if not html_files:
         print(f"No HTML files found in {html_dir}!")
@@ -28,59 +65,313 @@ def convert_html_to_json(html_dir="html_pages", output_file="posts.json"):
     
     print(f"Found {len(html_files)} HTML files to convert")
     
-    # List to store all converted pages
-    all_posts = []
-    
-    for html_file in html_files:
-        try:
-            # Extract title from filename (remove .html extension)
+    # Work out which files changed since the last run
+    manifest = {}
+    unchanged = set()
+    previous_posts = {}
+    if incremental:
+        if manifest_file is None:
+            manifest_file = os.path.splitext(output_file)[0] + '.manifest.json'
+        # A change to any of these changes the output, so nothing can be reused
+        options = {'dedupe': dedupe, 'normalize': normalize, 'output_format': output_format,
+                   'compress': output_file.endswith('.gz') if compress is None else bool(compress),
+                   'store_file': store_file}
+        old_manifest = load_manifest(manifest_file, options) if os.path.exists(output_file) else {}
+        
+        for html_file in html_files:
+            entry, same = _manifest_entry(os.path.join(html_dir, html_file), old_manifest.get(html_file))
+            manifest[html_file] = entry
+            if same:
+                unchanged.add(html_file)
+        
+        store_ready = store_file is None or os.path.exists(index_path(store_file))
+        if len(unchanged) == len(html_files) == len(old_manifest) and store_ready:
+            if manifest != old_manifest:
+                save_manifest(manifest_file, manifest, options)
+            print(f"{output_file} is up to date")
+            return len(html_files)
+        
+        if unchanged:
+            previous_posts = {post['Title']: post for post in iter_posts(output_file)}
+    
+    # Drop or rename duplicate pages before any of them is parsed
+    slugs = {}
+    if dedupe:
+        html_files, slugs = _resolve_duplicates(html_dir, html_files, manifest, dedupe, store_dir)
+    
+    # Convert the files that are not reused from the previous output
+    to_convert = [f for f in html_files
+                  if f not in unchanged or os.path.splitext(f)[0] not in previous_posts]
+    results = _convert_files(html_dir, to_convert, workers, chunksize, backend, store_dir, normalize)
+    reused = 0
+    
+    # Write each post as soon as it is ready, keeping the files' order
+    store_writer = PostStoreWriter(store_file) if store_file else nullcontext()
+    with PostWriter(output_file, output_format, compress) as writer, store_writer as store:
+        for html_file in html_files:
             title = os.path.splitext(html_file)[0]
+            if html_file in unchanged and title in previous_posts:
+                post = previous_posts.pop(title)
+                post['Slug'] = slugs.get(html_file, make_slug(title))
+                writer.write(post)
+                if store is not None:
+                    store.write(post)
+                reused += 1
+                if metrics is not None:
+                    metrics.inc('convert_files_total', result='reused')
+                continue
             
-            # Create slug from title
-            slug = title.lower().replace(' ', '-')
-            # Remove any special characters from slug
-            slug = re.sub(r'[^a-z0-9-]', '', slug)
-            
-            # Read HTML file
-            with open(os.path.join(html_dir, html_file), 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            
-            # Parse HTML
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Process the content into rich text JSON format
-            content_nodes = []
-            
-            # Process all top-level elements
-            top_elements = soup.find_all(recursive=False)
-            
-            for element in top_elements:
-                node = process_element(element)
-                if node:
-                    content_nodes.append(node)
-            
-            # Create post object
-            post = {
-                "Title": title,
-                "Slug": slug,
-                "Content": {
-                    "type": "doc",
-                    "content": content_nodes
-                }
-            }
-            
-            all_posts.append(post)
-            print(f"Converted {html_file} to JSON")
-            
-        except Exception as e:
-            print(f"Error converting {html_file}: {e}")
+            _, post, error, seconds = next(results)
+            if error is None:
+                if html_file in slugs:
+                    post['Slug'] = slugs[html_file]
+                bytes_out = writer.write(post)
+                if store is not None:
+                    store.write(post)
+                print(f"Converted {html_file} to JSON")
+                if metrics is not None:
+                    _record_conversion(metrics, html_dir, html_file, post, seconds, bytes_out, backend)
+            else:
+                print(f"Error converting {html_file}: {error}")
+                if metrics is not None:
+                    metrics.inc('convert_files_total', result='error')
+                # Leave it out of the manifest so the next run retries it
+                manifest.pop(html_file, None)
+    
+    if reused:
+        print(f"Reused {reused} unchanged posts from {output_file}")
+    
+    if incremental:
+        save_manifest(manifest_file, manifest, options)
+    
+    print(f"Saved {writer.count} posts to {output_file}")
+    return writer.count
+
+
+def _record_conversion(metrics, html_dir, html_file, post, seconds, bytes_out, backend):
+    """Add one converted file to the metrics"""
+    bytes_in = os.path.getsize(os.path.join(html_dir, html_file))
+    nodes = count_nodes(post['Content']['content'])
+    metrics.inc('convert_files_total', result='converted')
+    metrics.inc('convert_bytes_in_total', bytes_in)
+    metrics.inc('convert_bytes_out_total', bytes_out)
+    metrics.observe('convert_parse_seconds', seconds, backend=backend)
+    metrics.observe('convert_nodes', nodes, buckets=NODE_BUCKETS)
+    metrics.record('convert_files', file=html_file, seconds=round(seconds, 6), nodes=nodes,
+                   bytes_in=bytes_in, bytes_out=bytes_out)
+
+
+def _resolve_duplicates(html_dir, html_files, manifest, policy, store_dir=None):
+    """Report duplicate pages and apply a duplicate policy
+    
+    With a content store, pages whose HTML differs but whose doc, as
+    converted in an earlier run, is identical are duplicates too.
     
-    # Save all posts to a JSON file
-    with open(output_file, "w", encoding='utf-8') as f:
-        json.dump(all_posts, f, indent=2, ensure_ascii=False)
+    Returns:
+        tuple: (files to convert, {file: slug} for files whose slug changes)
+    """
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy: {policy}")
     
-    print(f"Saved {len(all_posts)} posts to {output_file}")
-    return len(all_posts)
+    store = ContentStore(store_dir) if store_dir else None
+    entries = []
+    for html_file in html_files:
+        title = os.path.splitext(html_file)[0]
+        if html_file in manifest:
+            html_hash = manifest[html_file]['sha256']
+        else:
+            html_hash = sha256_file(os.path.join(html_dir, html_file))
+        stored = store.get(html_hash) if store is not None else None
+        entries.append((title, make_slug(base_title(title)), html_hash, stored and stored['doc_hash']))
+    
+    dropped = set()
+    for group in find_duplicates(entries):
+        doc_hashes = {entries[i][3] for i in group}
+        if len({entries[i][2] for i in group}) == 1:
+            reason = 'same content'
+        elif len(doc_hashes) == 1 and None not in doc_hashes:
+            reason = 'same converted doc'
+        else:
+            reason = 'same title'
+        names = ", ".join(html_files[i] for i in group)
+        print(f"Duplicate pages ({reason}): {names}")
+        if policy == "first":
+            # The original rather than a "Page (1)" copy, else the first in sorted order
+            keep = min(group, key=lambda i: (entries[i][0] != base_title(entries[i][0]), i))
+        elif policy == "newest":
+            keep = max(group, key=lambda i: os.path.getmtime(os.path.join(html_dir, html_files[i])))
+        else:
+            continue
+        dropped.update(i for i in group if i != keep)
+        print(f"Keeping {html_files[keep]}")
+    
+    kept = [html_file for i, html_file in enumerate(html_files) if i not in dropped]
+    titles = [os.path.splitext(html_file)[0] for html_file in kept]
+    slugs = unique_slugs([make_slug(title) for title in titles])
+    changed = {html_file: slug for html_file, title, slug in zip(kept, titles, slugs)
+               if slug != make_slug(title)}
+    return kept, changed
+
+
+def _convert_files(html_dir, html_files, workers=1, chunksize=None, backend="soup", store_dir=None,
+                   normalize=False):
+    """Convert files, in a process pool when more than one worker is requested
+    
+    Yields:
+        tuple: (html_file, post, error, seconds) in the order of ``html_files``
+    """
+    paths = [os.path.join(html_dir, html_file) for html_file in html_files]
+    convert = partial(_convert_file_safely, backend=backend, store_dir=store_dir, normalize=normalize)
+    if workers <= 1 or len(paths) <= 1:
+        results = map(convert, paths)
+        for html_file, (post, error, seconds) in zip(html_files, results):
+            yield html_file, post, error, seconds
+        return
+    
+    if chunksize is None:
+        chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(convert, paths, chunksize=chunksize)
+        for html_file, (post, error, seconds) in zip(html_files, results):
+            yield html_file, post, error, seconds
+
+
+def _convert_file_safely(html_path, backend="soup", store_dir=None, normalize=False):
+    """Convert a file, returning the error message instead of raising
+    
+    Returns:
+        tuple: (post, error, seconds spent converting)
+    """
+    start = time.perf_counter()
+    try:
+        store = _open_store(store_dir) if store_dir else None
+        return convert_html_file(html_path, backend, store, normalize), None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+
+@lru_cache(maxsize=None)
+def _open_store(store_dir):
+    """One ContentStore per directory and process"""
+    return ContentStore(store_dir)
+
+
+def load_manifest(manifest_file, options=None):
+    """Load a conversion manifest
+    
+    Returns an empty manifest if the file is missing or unreadable, or was
+    written with different ``options``, so that everything is converted again.
+    """
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('options', {}) != (options or {}):
+        return {}
+    return data.get('files', {})
+
+
+def save_manifest(manifest_file, files, options=None):
+    """Write a conversion manifest atomically"""
+    with atomic_write(manifest_file) as f:
+        json.dump({'version': 1, 'options': options or {}, 'files': files}, f, indent=2, ensure_ascii=False)
+
+
+def _manifest_entry(html_path, previous):
+    """Fingerprint an HTML file and compare it to its previous manifest entry
+    
+    The size and modification time are checked first so that unchanged
+    files are never read; the content hash settles the rest.
+    
+    Returns:
+        tuple: (entry, unchanged)
+    """
+    stat = os.stat(html_path)
+    if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+        return previous, True
+    
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256_file(html_path)}
+    return entry, bool(previous) and previous['sha256'] == entry['sha256']
+
+
+def convert_html_file(html_path, backend="soup", store=None, normalize=False):
+    """Convert a single exported HTML file into a post
+    
+    Args:
+        html_path (str): Path of the HTML file; its name becomes the title
+        backend (str): "soup" parses the page into a BeautifulSoup tree;
+            "stream" builds the doc in one pass from parser events
+            (see stream_converter.py) and gives the same output
+        store (ContentStore): Reuse the doc of identical HTML converted earlier
+        normalize (bool): Compact the doc with doc_model.normalize_nodes
+    
+    Returns:
+        dict: The post object
+    """
+    # Extract title from filename (remove .html extension)
+    title = os.path.splitext(os.path.basename(html_path))[0]
+    
+    slug = make_slug(title)
+    
+    # Identical HTML that was converted before needs no parsing
+    entry = None
+    if store is not None:
+        html_hash = sha256_file(html_path)
+        entry = store.get(html_hash)
+    
+    if entry is not None:
+        content_nodes = entry['doc']
+    elif backend == "stream":
+        from stream_converter import convert_html_stream
+        with open(html_path, 'r', encoding='utf-8') as f:
+            content_nodes = convert_html_stream(f)
+    elif backend == "soup":
+        from bs4 import BeautifulSoup
+        
+        # Read HTML file
+        with open(html_path, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+        
+        # Parse HTML
+        soup = BeautifulSoup(html_content, 'html.parser')
+        
+        # Process the content into rich text JSON format
+        content_nodes = []
+        
+        # Process all top-level elements
+        top_elements = soup.find_all(recursive=False)
+        
+        for element in top_elements:
+            node = process_element(element)
+            if node:
+                content_nodes.append(node)
+    else:
+        raise ValueError(f"Unknown converter backend: {backend}")
+    
+    if store is not None and entry is None:
+        store.put(html_hash, content_nodes)
+    
+    if normalize:
+        content_nodes = normalize_nodes(content_nodes)
+    
+    # Create post object
+    return {
+        "Title": title,
+        "Slug": slug,
+        "Content": {
+            "type": "doc",
+            "content": content_nodes
+        }
+    }
+
+
+def make_slug(title):
+    """Create a URL slug from a page title"""
+    # Create slug from title
+    slug = title.lower().replace(' ', '-')
+    # Remove any special characters from slug
+    return re.sub(r'[^a-z0-9-]', '', slug)
 
 
 def process_element(element):
@@ -126,9 +417,9 @@ def process_paragraph(element):
     attrs = {}
     
     # Extract text-align attribute
-    align_match = re.search(r'text-align:\s*([^;]+)', style)
-    if align_match:
-        attrs['textAlign'] = align_match.group(1).strip()
+    text_align = style_text_align(style)
+    if text_align is not None:
+        attrs['textAlign'] = text_align
     
     return {
         "type": "paragraph",
@@ -156,9 +447,9 @@ def process_heading(element):
     attrs = {"level": level}
     
     # Extract text-align attribute
-    align_match = re.search(r'text-align:\s*([^;]+)', style)
-    if align_match:
-        attrs['textAlign'] = align_match.group(1).strip()
+    text_align = style_text_align(style)
+    if text_align is not None:
+        attrs['textAlign'] = text_align
     
     return {
         "type": "heading",
@@ -212,37 +503,22 @@ def process_list_item(element):
 
 def process_text(element):
     """Process text content into rich text JSON format"""
+    return make_text_nodes(element.get_text(), element.name, element.get('style', ''))
+
+
+def make_text_nodes(text_content, name, style):
+    """Build the text nodes for an element's text, tag name and inline style
+    
+    Shared by the BeautifulSoup and streaming backends.
+    """
     text_nodes = []
     
-    # Get the text content
-    text_content = element.get_text()
+    # Skip whitespace-only text
     if not text_content.strip():
         return text_nodes
     
-    # Get style attributes
-    style = element.get('style', '')
-    marks = []
-    
-    # Check for bold text
-    if element.name == 'strong' or element.name == 'b' or 'font-weight: bold' in style:
-        marks.append({"type": "bold"})
-    
-    # Check for italic text
-    if element.name == 'em' or element.name == 'i' or 'font-style: italic' in style:
-        marks.append({"type": "italic"})
-    
-    # Check for underline
-    if element.name == 'u' or 'text-decoration: underline' in style:
-        marks.append({"type": "underline"})
-    
-    # Check for font size
-    font_size_match = re.search(r'font-size:\s*([^;]+)', style)
-    if font_size_match:
-        size = font_size_match.group(1).strip()
-        marks.append({
-            "type": "textStyle",
-            "attrs": {"fontSize": size}
-        })
+    # Marks are cached per (tag, style) and shared between nodes
+    marks = resolve_marks(name, style)
     
     # Create the text node
     text_node = {
@@ -252,12 +528,21 @@ def process_text(element):
     
     # Add marks if any
     if marks:
-        text_node["marks"] = marks
+        text_node["marks"] = list(marks)
     
     text_nodes.append(text_node)
     return text_nodes
 
 
+@lru_cache(maxsize=1024)
+def style_text_align(style):
+    """Return the text-align value of an inline style, or None"""
+    align_match = _TEXT_ALIGN.search(style)
+    if align_match:
+        return align_match.group(1).strip()
+    return None
+
+
 if __name__ == "__main__":
     # For direct execution of this file
     convert_html_to_json() 
\ No newline at end of file
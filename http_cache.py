@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from post_writer import atomic_write
+
+
+class CacheEntry:
+    __slots__ = ('data', 'etag', 'last_modified', 'stored_at', 'size')
+
+    def __init__(self, data: Any, etag: Optional[str], last_modified: Optional[str],
+                 stored_at: float, size: int):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.size = size
+
+    def validators(self) -> Dict[str, str]:
+        """Headers that turn a request into a conditional one"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Cache of JSON API responses with ETag / Last-Modified revalidation
+
+    Entries younger than ``ttl`` are served without a request. Older ones
+    are kept so they can be revalidated with a conditional request, which
+    costs a 304 instead of a full response. The cache is an LRU bounded by
+    ``max_entries`` and ``max_bytes``; with ``cache_dir`` entries are also
+    written to disk and survive between runs. An evicted entry's file is
+    deleted, and on startup the directory is pruned to the same limits,
+    keeping the most recently written files.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 256, max_bytes: int = 16 * 1024 * 1024,
+                 cache_dir: Optional[str] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self._prune_dir()
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]] = None, token: Optional[str] = None) -> str:
+        """The cache key of a request
+
+        With ``token``, the key includes a hash of the API token, so
+        accounts sharing a ``cache_dir`` never see each other's responses.
+        """
+        if params:
+            url = url + '?' + '&'.join(f"{k}={params[k]}" for k in sorted(params))
+        if token:
+            url = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16] + ' ' + url
+        return url
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for a key, fresh or not, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._load(key)
+        if entry is not None:
+            with self._lock:
+                evicted = self._insert(key, entry)
+            self._delete(evicted)
+        return entry
+
+    def put(self, key: str, data: Any, etag: Optional[str] = None, last_modified: Optional[str] = None,
+            size: int = 0) -> CacheEntry:
+        entry = CacheEntry(data, etag, last_modified, time.time(), size)
+        with self._lock:
+            evicted = self._insert(key, entry)
+        self._delete(evicted)
+        self._save(key, entry)
+        return entry
+
+    def touch(self, key: str, entry: CacheEntry):
+        """Mark an entry as fresh again after a 304"""
+        entry.stored_at = time.time()
+        self._save(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _insert(self, key: str, entry: CacheEntry) -> List[str]:
+        """Add an entry, returning the keys of the entries evicted to make room"""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        self._entries[key] = entry
+        self.size += entry.size
+        # Evict least recently used entries until both limits hold
+        evicted_keys = []
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            evicted_keys.append(evicted_key)
+        return evicted_keys
+
+    def _delete(self, keys: List[str]):
+        """Remove the files of evicted entries"""
+        if not self.cache_dir:
+            return
+        for key in keys:
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _prune_dir(self):
+        """Delete the oldest files of the cache directory beyond the cache's limits"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        files.sort(reverse=True)
+        total = 0
+        for count, (_, size, name) in enumerate(files, 1):
+            total += size
+            if count > self.max_entries or total > self.max_bytes:
+                os.unlink(os.path.join(self.cache_dir, name))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _save(self, key: str, entry: CacheEntry):
+        if not self.cache_dir:
+            return
+        with atomic_write(self._path(key)) as f:
+            json.dump({'key': key, 'data': entry.data, 'etag': entry.etag,
+                       'last_modified': entry.last_modified, 'stored_at': entry.stored_at,
+                       'size': entry.size}, f, ensure_ascii=False)
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('key') != key:
+            return None
+        return CacheEntry(saved['data'], saved.get('etag'), saved.get('last_modified'),
+                          saved['stored_at'], saved.get('size', 0))
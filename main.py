@@ -1,64 +1,336 @@
+"""Export Coda pages and convert them to posts
+
+Examples:
+    python main.py convert --workers 4 --backend stream
+    python main.py scrape --doc-id kNpO-305IT --parent "Services" --recursive
+    python main.py download --workers 8
+    python main.py pipeline --config coda_config.json
+
+Settings are taken from command-line flags, then the CODA_API_TOKEN and
+CODA_DOC_ID environment variables, then a JSON config file (--config,
+$CODA_CONFIG or coda_config.json) whose keys are the long option names,
+e.g. {"doc_id": "...", "format": "ndjson", "workers": 8}. Config values are
+checked like flag values. Without arguments the interactive menu is shown.
+
+Each command imports only the modules it needs, so ``--help`` and
+``convert`` start without loading requests.
+"""
 import os
+import sys
 import json
-import time
-import webbrowser
-import re
-from coda_scraper import CodaPageScraper
-from html_converter import convert_html_to_json
-
-def scrape_coda():
-    # Replace with your API token
-    API_TOKEN = "36530698-21e4-4dda-87cf-4f2469449fcf"
-    DOC_ID = "kNpO-305IT"
-    
-    # Initialize scraper
-    scraper = CodaPageScraper(API_TOKEN)
-
-    # Create html_pages directory if it doesn't exist
-    html_dir = "html_pages"
-    if not os.path.exists(html_dir):
-        os.makedirs(html_dir)
-        print(f"Created directory: {html_dir}")
+import argparse
+
+DEFAULT_CONFIG_FILE = "coda_config.json"
+
+# Environment variables and the settings they provide
+ENVIRONMENT = {
+    'CODA_API_TOKEN': 'api_token',
+    'CODA_DOC_ID': 'doc_id',
+}
+
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
+
+def load_config(path, required=False):
+    """Read a JSON config file, accepting "doc-id" and "doc_id" style keys"""
+    if not os.path.exists(path):
+        if required:
+            raise SystemExit(f"Config file not found: {path}")
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return {key.replace('-', '_'): value for key, value in config.items()}
+
+
+def settings_defaults(argv):
+    """Defaults from the environment, which overrides the config file"""
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument('--config')
+    known, _ = pre.parse_known_args(argv)
+    path = known.config or os.environ.get('CODA_CONFIG')
+    defaults = load_config(path or DEFAULT_CONFIG_FILE, required=path is not None)
+    for variable, name in ENVIRONMENT.items():
+        if os.environ.get(variable):
+            defaults[name] = os.environ[variable]
+    return defaults
+
+
+def config_defaults(parser, settings):
+    """Turn settings keyed by long option name into defaults for a parser
+
+    "format" sets the ``output_format`` of ``--format``, "no_artifacts": true
+    acts like passing ``--no-artifacts`` (flags take only true or false),
+    and a key may also be the option's dest. Values are converted and
+    checked like flag values, so "8" is accepted for ``--workers``; settings
+    for options the command does not have are ignored.
+    """
+    options, dests = {}, {}
+    for action in parser._actions:
+        if isinstance(action, argparse._HelpAction):
+            continue
+        dests[action.dest] = action
+        for option in action.option_strings:
+            if option.startswith('--'):
+                options[option[2:].replace('-', '_')] = action
+
+    defaults = {}
+    for name, value in settings.items():
+        action = options.get(name, dests.get(name))
+        if action is None:
+            continue
+        if isinstance(action, argparse._StoreConstAction):
+            # A flag: true in the config means the flag was given
+            if not isinstance(value, bool):
+                parser.error(f"invalid value for {name} in the config file: {value!r} (use true or false)")
+            if name != action.dest:
+                value = action.const if value else action.default
+        elif value is not None and action.type is not None:
+            try:
+                value = action.type(value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError):
+                parser.error(f"invalid value for {name} in the config file: {value!r}")
+        if action.choices is not None and value is not None and value not in action.choices:
+            choices = ', '.join(map(repr, action.choices))
+            parser.error(f"invalid value for {name} in the config file: {value!r} (choose from {choices})")
+        defaults[action.dest] = value
+    return defaults
+
+
+def build_parser(defaults=None, command=None):
+    """The command-line parser, with ``defaults`` applied to ``command`` (or to every command)"""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help=f"JSON config file (default: $CODA_CONFIG or {DEFAULT_CONFIG_FILE})")
+    common.add_argument('--metrics', metavar='FILE',
+                        help="Write a JSON metrics report here, and a .prom file next to it")
+
+    api = argparse.ArgumentParser(add_help=False)
+    api.add_argument('--api-token', help="Coda API token (default: $CODA_API_TOKEN)")
+    api.add_argument('--doc-id', help="Coda doc ID (default: $CODA_DOC_ID)")
+    api.add_argument('--base-url', default="https://coda.io/apis/v1", help="Coda API base URL")
+    api.add_argument('--journal', default="exports.jsonl", help="Export journal used to resume runs")
+    api.add_argument('--index-cache', help="Cache the doc's page list in this file")
+
+    select = argparse.ArgumentParser(add_help=False)
+    select.add_argument('--parent', help="Only pages under the page with this name")
+    select.add_argument('--recursive', action='store_true', help="Include every page below --parent")
+
+    convert = argparse.ArgumentParser(add_help=False)
+    convert.add_argument('--html-dir', default="html_pages", help="Directory of exported HTML files")
+    convert.add_argument('--output', default="posts.json", help="Output file (.gz to compress)")
+    convert.add_argument('--format', dest='output_format', default="json",
+                         choices=("json", "json-compact", "ndjson"), help="Output layout")
+
+    parser = argparse.ArgumentParser(
+        description="Export Coda pages and convert them to posts. Run without arguments for a menu.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+
+    scrape = subparsers.add_parser('scrape', parents=[common, api, select],
+                                   help="Start exports and save their request IDs to the pages file")
+    scrape.add_argument('--pages-file', default="pages.json", help="Where to save [page_id, request_id] pairs")
+    scrape.set_defaults(func=cmd_scrape)
+
+    download = subparsers.add_parser('download', parents=[common, api],
+                                     help="Download the exports listed in the pages file")
+    download.add_argument('--pages-file', default="pages.json", help="[page_id, request_id] pairs to download")
+    download.add_argument('--html-dir', default="html_pages", help="Directory to save the HTML files in")
+    download.add_argument('--workers', type=positive_int, default=8, help="Download threads")
+    download.add_argument('--timeout', type=float, default=600, help="Deadline for exports to finish (seconds)")
+    download.add_argument('--dedupe', action='store_true', help="Keep one copy of identical downloads")
+    download.add_argument('--links-file', default="download_links.txt", help="Where to save the used links")
+    download.set_defaults(func=cmd_download)
+
+    convert_cmd = subparsers.add_parser('convert', parents=[common, convert],
+                                        help="Convert HTML files to posts")
+    convert_cmd.add_argument('--incremental', action='store_true', help="Only convert new or changed files")
+    convert_cmd.add_argument('--manifest', help="Manifest file for --incremental")
+    convert_cmd.add_argument('--workers', type=positive_int, default=1, help="Conversion processes")
+    convert_cmd.add_argument('--chunksize', type=positive_int, help="Files handed to a worker at a time")
+    convert_cmd.add_argument('--backend', default="soup", choices=("soup", "stream"), help="Converter backend")
+    convert_cmd.add_argument('--dedupe', choices=("first", "newest", "all"), help="Duplicate page policy")
+    convert_cmd.add_argument('--store-dir', help="Content-addressed store of converted docs")
+    convert_cmd.add_argument('--normalize', action='store_true', help="Merge text nodes, drop empty fields")
+    convert_cmd.add_argument('--post-store', metavar='FILE',
+                             help="Also write an indexed NDJSON store for lookups by slug or title")
+    convert_cmd.add_argument('--profile', action='store_true', help="Print a cProfile of the process_* functions")
+    convert_cmd.set_defaults(func=cmd_convert)
+
+    pipeline = subparsers.add_parser('pipeline', parents=[common, api, select, convert],
+                                     help="Export, download and convert in one concurrent run")
+    pipeline.add_argument('--pages-file', default="pages.json",
+                          help="Pages to export, if it exists and no --parent is given; "
+                               "rewritten with the request IDs")
+    pipeline.add_argument('--links-file', default="download_links.txt", help="Where to save the used links")
+    pipeline.add_argument('--all-pages', action='store_true', help="Export every page of the doc")
+    pipeline.add_argument('--timeout', type=float, default=600, help="Deadline for exports to finish (seconds)")
+    pipeline.add_argument('--initiate-workers', type=positive_int, default=2, help="Threads starting exports")
+    pipeline.add_argument('--poll-workers', type=positive_int, default=8, help="Export status checks in flight")
+    pipeline.add_argument('--download-workers', type=positive_int, default=4, help="Download threads")
+    pipeline.add_argument('--convert-workers', type=positive_int, default=2, help="Conversion threads")
+    pipeline.add_argument('--queue-size', type=positive_int, default=32, help="Pages waiting between two stages")
+    pipeline.add_argument('--no-artifacts', dest='artifacts', action='store_false',
+                          help="Do not write the pages and links files")
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    if defaults:
+        for name, subparser in subparsers.choices.items():
+            if command in (None, name):
+                subparser.set_defaults(**config_defaults(subparser, defaults))
+    return parser
+
+
+def make_scraper(args, metrics):
+    from coda_scraper import CodaPageScraper
+    if not args.api_token or not args.doc_id:
+        raise SystemExit("An API token and doc ID are required: use --api-token/--doc-id, "
+                         "CODA_API_TOKEN/CODA_DOC_ID or the config file")
+    return CodaPageScraper(args.api_token, base_url=args.base_url, metrics=metrics)
+
+
+def select_pages(args, scraper):
+    """IDs of the pages under --parent, or of every page"""
+    if args.parent:
+        page_ids = scraper.filter_pages_by_parent(args.doc_id, args.parent, args.recursive, args.index_cache)
+        print(f"Found {len(page_ids)} pages under {args.parent}")
+    else:
+        page_ids = [page['id'] for page in scraper.get_page_index(args.doc_id, args.index_cache)]
+        print(f"Found {len(page_ids)} pages")
+    return page_ids
+
+
+def cmd_scrape(args, metrics):
+    from export_journal import ExportJournal
+
+    scraper = make_scraper(args, metrics)
+    page_ids = select_pages(args, scraper)
+    pages = scraper.initiate_exports(args.doc_id, page_ids, journal=ExportJournal(args.journal))
+    with open(args.pages_file, "w") as f:
+        json.dump(pages, f, indent=2)
+    print(f"Saved {len(pages)} export requests to {args.pages_file}")
+    return 0 if len(pages) == len(page_ids) else 1
+
+
+def cmd_download(args, metrics):
+    from downloader import ExportDownloader
+    from export_journal import ExportJournal
+
+    scraper = make_scraper(args, metrics)
+    with open(args.pages_file) as f:
+        all_pages = json.load(f)
+    print(f"Loaded {len(all_pages)} pages from {args.pages_file}")
+    # The pipeline lists pages whose export never started with a null request ID
+    pages = [page for page in all_pages if page[1]]
+    if len(pages) < len(all_pages):
+        print(f"Skipping {len(all_pages) - len(pages)} pages without an export request")
+
+    # Download every export as soon as it is ready
+    # The journal lets a rerun skip pages that were already downloaded
+    downloader = ExportDownloader(scraper, args.doc_id, args.html_dir, max_workers=args.workers,
+                                  journal=ExportJournal(args.journal), dedupe=args.dedupe)
+    paths = downloader.download_exports(pages, timeout=args.timeout)
+
+    # Save the download links that were used to a file
+    with open(args.links_file, "w") as f:
+        for page in all_pages:
+            if page[0] in downloader.links:
+                f.write(f"{downloader.links[page[0]]}\n")
+
+    print(f"\nDownloaded {len(paths)} of {len(all_pages)} pages to {args.html_dir}")
+    return 0 if len(paths) == len(all_pages) else 1
+
+
+def cmd_convert(args, metrics):
+    from html_converter import convert_html_to_json
+
+    def convert():
+        return convert_html_to_json(args.html_dir, args.output, incremental=args.incremental,
+                                    manifest_file=args.manifest, workers=args.workers, chunksize=args.chunksize,
+                                    backend=args.backend, output_format=args.output_format,
+                                    dedupe=args.dedupe, store_dir=args.store_dir, normalize=args.normalize,
+                                    metrics=metrics, store_file=args.post_store)
+
+    if args.profile:
+        from metrics import profile
+        with profile(pattern="process_"):
+            convert()
+    else:
+        convert()
+    return 0
+
+
+def cmd_pipeline(args, metrics):
+    from export_journal import ExportJournal
+    from pipeline import ExportPipeline
+
+    scraper = make_scraper(args, metrics)
+    if args.parent or args.all_pages or not os.path.exists(args.pages_file):
+        page_ids = select_pages(args, scraper)
+    else:
+        with open(args.pages_file) as f:
+            page_ids = [page[0] for page in json.load(f)]
+        print(f"Loaded {len(page_ids)} pages from {args.pages_file}")
+
+    pipeline = ExportPipeline(scraper, args.doc_id, args.html_dir, args.output,
+                              initiate_workers=args.initiate_workers, poll_workers=args.poll_workers,
+                              download_workers=args.download_workers, convert_workers=args.convert_workers,
+                              queue_size=args.queue_size, timeout=args.timeout, artifacts=args.artifacts,
+                              journal=ExportJournal(args.journal), output_format=args.output_format,
+                              pages_file=args.pages_file, links_file=args.links_file)
+    converted = pipeline.run(page_ids)
+    return 0 if converted == len(page_ids) else 1
+
+
+def choose_command():
+    """The interactive menu, for runs without arguments"""
+    print("Select an operation:")
+    print("1. Download Coda page exports")
+    print("2. Convert HTML files to JSON")
+    print("3. Run the full pipeline (export, download and convert)")
+
+    choice = input("Enter your choice (1, 2 or 3): ")
+    commands = {"1": "download", "2": "convert", "3": "pipeline"}
+    if choice not in commands:
+        print("Invalid choice. Please enter 1, 2 or 3.")
+        return None
+    return [commands[choice]]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        if not sys.stdin.isatty():
+            build_parser().print_help()
+            return 2
+        argv = choose_command()
+        if argv is None:
+            return 2
+
+    args = build_parser(settings_defaults(argv), command=argv[0]).parse_args(argv)
+    if args.command is None:
+        build_parser().print_help()
+        return 2
+
+    metrics = None
+    if args.metrics:
+        from metrics import Metrics
+        metrics = Metrics()
 
     try:
-        # Load pages from the JSON file
-        all_pages = json.load(open("pages.json"))
-        print(f"Loaded {len(all_pages)} pages from pages.json")
-        
-        # Get download links for all pages
-        download_links = scraper.get_download_links(DOC_ID, all_pages)
-        
-        # Save all download links to a file
-        with open("download_links.txt", "w") as f:
-            for link in download_links:
-                f.write(f"{link}\n")
-        
-        print(f"\nFound {len(download_links)} download links. Saved to download_links.txt")
-        
-        # Ask if user wants to open links in browser
-        if download_links:
-            response = input("Do you want to open all download links in your browser? (y/n): ")
-            if response.lower() == 'y':
-                print("Opening download links in browser...")
-                for link in download_links:
-                    webbrowser.open(link)
-                    time.sleep(0.5)  # Small delay between opening tabs
-        
+        status = args.func(args, metrics)
     except Exception as e:
         print(f"An error occurred: {e}")
+        status = 1
+
+    if metrics is not None:
+        report_file, prom_file = metrics.write_report(args.metrics)
+        print(f"Saved metrics to {report_file} and {prom_file}")
+    return status
 
 
 if __name__ == "__main__":
-    # Ask user what operation to perform
-    print("Select an operation:")
-    print("1. Scrape Coda pages")
-    print("2. Convert HTML files to JSON")
-    
-    choice = input("Enter your choice (1 or 2): ")
-    
-    if choice == "1":
-        scrape_coda()
-    elif choice == "2":
-        convert_html_to_json()
-    else:
-        print("Invalid choice. Please enter 1 or 2.")
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import os
+import io
+import json
+import time
+import bisect
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+from post_writer import atomic_write
+
+# Seconds, from a fast cached call to a slow export poll
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Doc nodes per converted page
+NODE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Bucketed distribution of observed values, as Prometheus histograms count them"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given quantile"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts) if count},
+        }
+
+
+def _labels_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _prometheus_labels(labels: Tuple[Tuple[str, str], ...], **extra) -> str:
+    pairs = list(labels) + [(name, str(value)) for name, value in extra.items()]
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    """Counters, histograms and per-item records collected during a run
+
+    One instance can be shared by the scraper, the downloader and the
+    converter; it is thread-safe. ``write_report`` saves a JSON report and
+    the same counters and histograms in Prometheus text format.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.records = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels):
+        """Add a value to a histogram"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record(self, name: str, **fields):
+        """Keep one row of per-item detail (JSON report only)"""
+        with self._lock:
+            self.records.setdefault(name, []).append(fields)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                entry = histogram.to_dict()
+                entry['labels'] = dict(labels)
+                histograms.setdefault(name, []).append(entry)
+            return {
+                'started_at': self.started_at,
+                'elapsed_seconds': round(time.time() - self.started_at, 3),
+                'counters': counters,
+                'histograms': histograms,
+                'records': {name: list(rows) for name, rows in self.records.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """Render counters and histograms in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_prometheus_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prometheus_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_bucket{_prometheus_labels(labels, le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, report_file: str = "metrics.json") -> Tuple[str, str]:
+        """Write the JSON report and a ``.prom`` file next to it
+
+        Returns:
+            The paths of the JSON and Prometheus files
+        """
+        prom_file = os.path.splitext(report_file)[0] + '.prom'
+        for path, text in ((report_file, json.dumps(self.to_dict(), indent=2, ensure_ascii=False)),
+                           (prom_file, self.to_prometheus())):
+            with atomic_write(path) as f:
+                f.write(text)
+        return report_file, prom_file
+
+
+@contextmanager
+def profile(output_file: Optional[str] = None, memory: bool = False, limit: int = 20,
+            pattern: Optional[str] = None):
+    """Profile a block with cProfile, and optionally tracemalloc
+
+    Prints the functions with the most cumulative time, e.g.
+    ``pattern="process_"`` to see only the converter's ``process_*``
+    functions. Only the current process is profiled, so convert with
+    ``workers=1``.
+
+    Args:
+        output_file: Also save the raw profile here (for snakeviz, pstats)
+        memory: Print the lines that allocated the most memory
+        limit: Number of functions / lines to print
+        pattern: Only print functions whose name matches this regex
+    """
+    profiler = cProfile.Profile()
+    if memory:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream).sort_stats('cumulative')
+        restrictions = [pattern, limit] if pattern else [limit]
+        stats.print_stats(*restrictions)
+        print(stream.getvalue())
+        if output_file:
+            stats.dump_stats(output_file)
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            print("Top memory allocations:")
+            for stat in snapshot.statistics('lineno')[:limit]:
+                print(f"  {stat}")
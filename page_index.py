@@ -0,0 +1,115 @@
+import json
+import time
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+
+from post_writer import atomic_write
+
+
+class PageIndex:
+    """In-memory index of a doc's page tree
+
+    Lookups by ID or name are dictionary lookups, and subtrees are walked
+    through a parent -> children map, so selecting pages under a section
+    never re-lists the doc or scans every page.
+    """
+
+    def __init__(self, pages: Iterable[Dict[str, Any]]):
+        self.pages = []
+        self.by_id = {}
+        self.by_name = {}
+        self.children = {}
+        self._position = {}
+        for page in pages:
+            self.add(page)
+
+    def add(self, page: Dict[str, Any]):
+        page_id = page['id']
+        self._position[page_id] = len(self.pages)
+        self.pages.append(page)
+        self.by_id[page_id] = page
+        self.by_name.setdefault(page.get('name'), []).append(page_id)
+        parent = page.get('parent')
+        if parent:
+            self.children.setdefault(parent['id'], []).append(page_id)
+            # Keep parents findable by name even if they are not listed themselves
+            if parent['id'] not in self.by_id and parent.get('name') is not None:
+                ids = self.by_name.setdefault(parent['name'], [])
+                if parent['id'] not in ids:
+                    ids.append(parent['id'])
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.pages)
+
+    def get(self, page_id: str) -> Optional[Dict[str, Any]]:
+        """Return a page by ID"""
+        return self.by_id.get(page_id)
+
+    def find(self, name: str) -> List[str]:
+        """Return the IDs of all pages with a name"""
+        return list(self.by_name.get(name, []))
+
+    def subtree(self, page_id: str, recursive: bool = True) -> List[str]:
+        """Return the IDs of the pages below a page, in listing order
+
+        Args:
+            page_id: The root of the subtree (not included)
+            recursive: Include all descendants rather than only direct children
+        """
+        found = []
+        stack = [page_id]
+        seen = {page_id}
+        while stack:
+            for child_id in self.children.get(stack.pop(), []):
+                if child_id in seen:
+                    continue
+                seen.add(child_id)
+                found.append(child_id)
+                if recursive:
+                    stack.append(child_id)
+        found.sort(key=self._position.__getitem__)
+        return found
+
+    def under(self, parent_name: str, recursive: bool = False) -> List[str]:
+        """Return the IDs of the pages below every page called ``parent_name``"""
+        found = []
+        for parent_id in self.find(parent_name):
+            found.extend(self.subtree(parent_id, recursive))
+        # Several parents can share a name; keep listing order and drop repeats
+        found = list(dict.fromkeys(found))
+        found.sort(key=self._position.__getitem__)
+        return found
+
+    def save(self, cache_file: str, doc_updated_at: Optional[str] = None):
+        """Write the index to a cache file atomically"""
+        with atomic_write(cache_file) as f:
+            json.dump({
+                'version': 1,
+                'fetched_at': time.time(),
+                'doc_updated_at': doc_updated_at,
+                'pages': self.pages,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, cache_file: str, max_age: Optional[float] = None,
+             doc_updated_at: Optional[str] = None) -> Optional['PageIndex']:
+        """Load a cached index, or return None if it is missing or stale
+
+        Args:
+            cache_file: The cache file
+            max_age: Maximum age of the cache in seconds
+            doc_updated_at: The doc's current ``updatedAt``; a cache written
+                for another version of the doc is stale
+        """
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if max_age is not None and time.time() - data.get('fetched_at', 0) > max_age:
+            return None
+        if doc_updated_at is not None and data.get('doc_updated_at') != doc_updated_at:
+            return None
+        return cls(data.get('pages', []))
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from coda_scraper import CodaPageScraper
+from downloader import ExportDownloader
+from export_journal import ExportJournal
+from html_converter import convert_html_file
+from post_writer import PostWriter
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+def _dropped(item: Dict) -> Dict:
+    """The marker passed on in place of a page that a stage dropped"""
+    return {'index': item['index'], 'page_id': item['page_id'], 'dropped': True}
+
+
+class ExportPipeline:
+    """Run initiate -> poll -> download -> convert as concurrent stages
+
+    Stages are connected by bounded queues, so a page can be converted while
+    others are still exporting, and a slow stage holds back the stages
+    before it instead of letting work pile up in memory.
+    """
+
+    def __init__(self, scraper: CodaPageScraper, doc_id: str, html_dir: str = "html_pages",
+                 output_file: str = "posts.json", initiate_workers: int = 2, poll_workers: int = 8,
+                 download_workers: int = 4, convert_workers: int = 2, queue_size: int = 32,
+                 timeout: float = 600.0, artifacts: bool = False, journal: Optional[ExportJournal] = None,
+                 output_format: str = "json", pages_file: str = "pages.json",
+                 links_file: str = "download_links.txt"):
+        self.scraper = scraper
+        self.doc_id = doc_id
+        self.html_dir = html_dir
+        self.output_file = output_file
+        self.workers = {
+            'initiate': initiate_workers,
+            'poll': poll_workers,
+            'download': download_workers,
+            'convert': convert_workers,
+        }
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.artifacts = artifacts
+        self.pages_file = pages_file
+        self.links_file = links_file
+        self.output_format = output_format
+        self.journal = journal
+        self.downloader = ExportDownloader(scraper, doc_id, html_dir, max_workers=download_workers,
+                                           journal=journal)
+
+    def _resume(self, item: Dict) -> Dict:
+        """Fill in what the journal already knows about a page"""
+        entry = self.journal.get(item['page_id'])
+        if not entry or entry['state'] == 'failed':
+            return item
+        item['request_id'] = entry['request_id']
+        if entry['state'] == 'downloaded' and self.journal.downloaded_path(item['page_id']):
+            item['path'] = entry['path']
+            item['link'] = entry.get('link')
+            self.downloader.reserve_path(entry['path'])
+        else:
+            # An unexpired link from an earlier run needs no polling
+            link = self.journal.link(item['page_id'], item['request_id'], self.downloader.expiry_margin)
+            if link:
+                item['link'] = link
+        return item
+
+    def _initiate(self, item: Dict) -> Optional[Dict]:
+        if item.get('request_id'):
+            return item
+        response = self.scraper.get_page_content(self.doc_id, item['page_id'])
+        item['request_id'] = response.get('requestId')
+        if self.journal is not None:
+            self.journal.initiated(item['page_id'], item['request_id'])
+        print(f"Initiated export for page {item['page_id']}, request ID: {item['request_id']}")
+        return item
+
+    def _polled(self, item: Dict, content: Dict) -> Optional[Dict]:
+        if content['status'] != 'complete':
+            if content['status'] == 'error':
+                print(f"Error checking page {item['page_id']}: {content['error']}")
+            else:
+                print(f"Page {item['page_id']} export status: {content['status']}")
+            # A failed or unreachable export (e.g. expired, 404) is requested
+            # again by the next run; a pending one is polled again
+            if content['status'] in ('failed', 'error') and self.journal is not None:
+                self.journal.failed(item['page_id'], item['request_id'])
+            return None
+        item['link'] = content['downloadLink']
+        if self.journal is not None:
+            self.journal.completed(item['page_id'], item['request_id'], item['link'])
+        return item
+
+    def _download(self, item: Dict) -> Optional[Dict]:
+        if item.get('path'):
+            print(f"Page {item['page_id']} already downloaded to {item['path']}, skipping")
+            return item
+        item['path'] = self.downloader.download(item['page_id'], item['request_id'], item['name'], item['link'])
+        item['link'] = self.downloader.links.get(item['page_id'], item['link'])
+        print(f"Downloaded page {item['page_id']} to {item['path']}")
+        return item
+
+    def _convert(self, item: Dict) -> Optional[Dict]:
+        item['post'] = convert_html_file(item['path'])
+        print(f"Converted {os.path.basename(item['path'])} to JSON")
+        return item
+
+    def _start_stage(self, name: str, func, inbox: queue.Queue, outbox: queue.Queue) -> List[threading.Thread]:
+        """Start the worker threads of one stage
+
+        A page that a stage drops is passed on marked ``dropped``, so the
+        writer knows not to wait for it. The last worker to see the end
+        marker passes it on downstream.
+        """
+        remaining = [self.workers[name]]
+        lock = threading.Lock()
+        metrics = self.scraper.metrics
+
+        def worker():
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    inbox.put(_DONE)
+                    break
+                if item.get('dropped'):
+                    outbox.put(item)
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = func(item)
+                except Exception as e:
+                    print(f"Error in {name} stage for page {item['page_id']}: {e}")
+                    result = None
+                metrics.observe('pipeline_stage_seconds', time.perf_counter() - start, stage=name)
+                metrics.inc('pipeline_items_total', stage=name, result='ok' if result is not None else 'dropped')
+                outbox.put(result if result is not None else _dropped(item))
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    outbox.put(_DONE)
+
+        threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True)
+                   for i in range(self.workers[name])]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _start_poll_stage(self, inbox: queue.Queue, outbox: queue.Queue) -> List[threading.Thread]:
+        """Start the poll stage, which polls every pending export from one scheduler
+
+        Exports are polled by ``CodaPageScraper.poll_exports``, with up to
+        ``poll_workers`` status checks in flight, backoff between checks,
+        tolerance for transient request errors and one deadline for the
+        whole run, so waiting on a slow export does not hold a thread.
+        """
+        feed = queue.Queue()
+        pending = {}
+        lock = threading.Lock()
+        metrics = self.scraper.metrics
+
+        def read():
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+                if item.get('dropped') or item.get('path') or item.get('link'):
+                    outbox.put(item)
+                    continue
+                with lock:
+                    pending.setdefault((item['page_id'], item['request_id']), []).append(
+                        (item, time.perf_counter()))
+                feed.put([item['page_id'], item['request_id']])
+            feed.put(None)
+
+        def schedule():
+            for page_id, request_id, content in self.scraper.poll_exports(
+                    self.doc_id, feed, max_workers=self.workers['poll'], timeout=self.timeout):
+                with lock:
+                    item, start = pending[(page_id, request_id)].pop(0)
+                result = self._polled(item, content)
+                metrics.observe('pipeline_stage_seconds', time.perf_counter() - start, stage='poll')
+                metrics.inc('pipeline_items_total', stage='poll', result='ok' if result is not None else 'dropped')
+                outbox.put(result if result is not None else _dropped(item))
+            reader.join()
+            outbox.put(_DONE)
+
+        reader = threading.Thread(target=read, name="poll-reader", daemon=True)
+        scheduler = threading.Thread(target=schedule, name="poll-scheduler", daemon=True)
+        reader.start()
+        scheduler.start()
+        return [reader, scheduler]
+
+    def run(self, page_ids: List[str], page_names: Optional[Dict[str, str]] = None) -> int:
+        """Export, download and convert pages
+
+        Args:
+            page_ids: The pages to process
+            page_names: Page ID to name mapping, fetched from the doc if omitted
+
+        Returns:
+            int: Number of posts converted
+        """
+        if not os.path.exists(self.html_dir):
+            os.makedirs(self.html_dir)
+        if page_names is None:
+            page_names = self.scraper.get_page_names(self.doc_id)
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(5)]
+        threads = self._start_stage('initiate', self._initiate, queues[0], queues[1])
+        threads += self._start_poll_stage(queues[1], queues[2])
+        threads += self._start_stage('download', self._download, queues[2], queues[3])
+        threads += self._start_stage('convert', self._convert, queues[3], queues[4])
+
+        items = [{'index': index, 'page_id': page_id, 'name': page_names.get(page_id, page_id)}
+                 for index, page_id in enumerate(page_ids)]
+        if self.journal is not None:
+            items = [self._resume(item) for item in items]
+
+        def feed():
+            for item in items:
+                queues[0].put(item)
+            queues[0].put(_DONE)
+
+        threading.Thread(target=feed, name="feed", daemon=True).start()
+
+        # Posts are written in page order as soon as every earlier page is
+        # written or dropped, so only out-of-order posts are held in memory
+        waiting = {}
+        next_index = 0
+        with PostWriter(self.output_file, self.output_format) as writer:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                waiting[item['index']] = item
+                while next_index in waiting:
+                    done = waiting.pop(next_index)
+                    if not done.get('dropped'):
+                        writer.write(done.pop('post'))
+                    next_index += 1
+        for thread in threads:
+            thread.join()
+        print(f"Saved {writer.count} posts to {self.output_file}")
+
+        if self.artifacts:
+            self._write_artifacts(items)
+        return writer.count
+
+    def _write_artifacts(self, items: List[Dict]):
+        """Write the intermediate files of the manual workflow for debugging
+
+        Every page is listed in the pages file, with a null request ID if its
+        export was never started, so the file can be the input of a later run.
+        """
+        with open(self.pages_file, "w") as f:
+            json.dump([[item['page_id'], item.get('request_id')] for item in items], f, indent=2)
+        with open(self.links_file, "w") as f:
+            for item in items:
+                if item.get('link'):
+                    f.write(f"{item['link']}\n")
+        print(f"Saved {self.pages_file} and {self.links_file}")
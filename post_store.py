@@ -0,0 +1,181 @@
+import os
+import json
+import mmap
+import struct
+
+from post_writer import create_temp_file
+
+# Index layout: header, slug table, title table, then the keys as UTF-8.
+# Each table has one entry per post, sorted by key, pointing at the post's
+# record in the NDJSON file and at its key.
+INDEX_MAGIC = b'POSTIDX1'
+_HEADER = struct.Struct('<8sIIQ')   # magic, version, count, size of the records file
+_ENTRY = struct.Struct('<QIII')     # record offset, record length, key offset, key length
+
+
+def index_path(store_file):
+    """The index file that belongs to a store's records file"""
+    return store_file + '.idx'
+
+
+class PostStoreWriter:
+    """Write posts as NDJSON records plus a binary slug / title index
+
+    The records file is ordinary NDJSON (``iter_posts`` reads it). The index
+    lets ``PostStore`` find a post by slug or title with a binary search and
+    decode only that post. Both files are written to temp files and renamed
+    into place when the writer is closed.
+    """
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.count = 0
+        self._entries = []
+        self._offset = 0
+        self._file = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        fd, self._tmp_path = create_temp_file(self.store_file)
+        self._file = os.fdopen(fd, 'wb')
+        return self
+
+    def write(self, post):
+        """Append one post"""
+        record = json.dumps(post, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._file.write(record)
+        self._entries.append((post.get('Slug', ''), post.get('Title', ''), self._offset, len(record)))
+        self._offset += len(record)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        index_tmp = self._tmp_path + '.idx'
+        try:
+            self._file.close()
+            if exc_type is None:
+                with open(index_tmp, 'wb') as f:
+                    f.write(self._build_index())
+                os.replace(self._tmp_path, self.store_file)
+                os.replace(index_tmp, index_path(self.store_file))
+        finally:
+            for path in (self._tmp_path, index_tmp):
+                if os.path.exists(path):
+                    os.unlink(path)
+        return False
+
+    def _build_index(self):
+        keys = bytearray()
+        tables = []
+        for field in (0, 1):
+            # Stable sort: posts that share a key stay in the order they were written
+            entries = sorted(self._entries, key=lambda entry: entry[field].encode('utf-8'))
+            table = bytearray()
+            for entry in entries:
+                key = entry[field].encode('utf-8')
+                table += _ENTRY.pack(entry[2], entry[3], len(keys), len(key))
+                keys += key
+            tables.append(table)
+        header = _HEADER.pack(INDEX_MAGIC, 1, len(self._entries), self._offset)
+        return header + tables[0] + tables[1] + keys
+
+
+class PostStore:
+    """Read-only, memory-mapped access to a store written by ``PostStoreWriter``
+
+    Opening a store reads nothing but the index header. ``get`` finds a
+    post with a binary search over the mapped index, touching about
+    log2(n) index entries, and decodes only that post's record.
+
+    Example:
+        with PostStore("posts.ndjson") as store:
+            post = store.get("chiropractor-manly")
+            for post in store:  # in slug order, one at a time
+                ...
+    """
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self._records = self._map(store_file)
+        self._index = self._map(index_path(store_file))
+
+        if len(self._index) < _HEADER.size:
+            raise ValueError(f"{index_path(store_file)} is not a post store index")
+        magic, version, self.count, records_size = _HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC or version != 1:
+            raise ValueError(f"{index_path(store_file)} is not a post store index")
+        if records_size != len(self._records):
+            raise ValueError(f"{store_file} does not match its index")
+        self._tables = (_HEADER.size, _HEADER.size + self.count * _ENTRY.size)
+        self._keys = _HEADER.size + 2 * self.count * _ENTRY.size
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            # mmap cannot map an empty file
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for mapped in (self._records, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, table, i):
+        return _ENTRY.unpack_from(self._index, self._tables[table] + i * _ENTRY.size)
+
+    def _key(self, table, i):
+        _, _, key_offset, key_length = self._entry(table, i)
+        start = self._keys + key_offset
+        return self._index[start:start + key_length]
+
+    def _find(self, table, key):
+        """Index of the first entry with ``key`` in a table, or None"""
+        key = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(table, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(table, low) == key:
+            return low
+        return None
+
+    def _record(self, table, i):
+        offset, length, _, _ = self._entry(table, i)
+        return json.loads(self._records[offset:offset + length])
+
+    def get(self, slug, default=None):
+        """Return the post with a slug (the first written, if several share it)"""
+        i = self._find(0, slug)
+        return default if i is None else self._record(0, i)
+
+    def get_by_title(self, title, default=None):
+        """Return the post with a title"""
+        i = self._find(1, title)
+        return default if i is None else self._record(1, i)
+
+    def __contains__(self, slug):
+        return self._find(0, slug) is not None
+
+    def slugs(self):
+        """Yield every slug in order, without decoding any post"""
+        for i in range(self.count):
+            yield self._key(0, i).decode('utf-8')
+
+    def __iter__(self):
+        """Yield the posts in slug order, decoding one at a time"""
+        for i in range(self.count):
+            yield self._record(0, i)
@@ -0,0 +1,184 @@
+import os
+import io
+import gzip
+import json
+import uuid
+from contextlib import contextmanager
+
+# Output formats understood by PostWriter
+OUTPUT_FORMATS = ("json", "json-compact", "ndjson")
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def create_temp_file(path, suffix='.tmp'):
+    """Create a hidden temp file next to ``path`` for an atomic replace
+
+    Unlike ``tempfile.mkstemp`` (always 0600), the file gets the same
+    permissions as one made by ``open()``, so they survive ``os.replace``.
+
+    Returns:
+        tuple: (file descriptor, temp path)
+    """
+    tmp_path = os.path.join(os.path.dirname(path) or '.',
+                            f".{os.path.basename(path)}.{uuid.uuid4().hex}{suffix}")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    return fd, tmp_path
+
+
+@contextmanager
+def atomic_write(path, encoding='utf-8'):
+    """Open a text file that replaces ``path`` in one step when the block ends
+
+    The file is written under a unique temp name, so concurrent writers of
+    the same path never share a temp file. If the block raises, ``path`` is
+    left as it was.
+
+    Example:
+        with atomic_write("state.json") as f:
+            json.dump(state, f)
+    """
+    fd, tmp_path = create_temp_file(path)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class PostWriter:
+    """Write posts to disk one at a time instead of holding them all in memory
+
+    Formats:
+        json: an indented JSON array, byte-for-byte what ``json.dump(posts, f, indent=2)`` writes
+        json-compact: a JSON array without indentation
+        ndjson: one compact JSON object per line
+
+    Output is written to a temp file next to ``output_file`` and renamed
+    into place when the writer is closed, so readers never see a partial
+    file. With ``compress`` (the default for ``.gz`` paths) it is gzipped.
+    """
+
+    def __init__(self, output_file, output_format="json", compress=None):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.output_file = output_file
+        self.output_format = output_format
+        self.compress = output_file.endswith('.gz') if compress is None else compress
+        self.count = 0
+        self._file = None
+        self._raw = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        fd, self._tmp_path = create_temp_file(self.output_file)
+        self._raw = os.fdopen(fd, 'wb')
+        stream = self._raw
+        if self.compress:
+            stream = gzip.GzipFile(fileobj=self._raw, mode='wb', filename='')
+        self._file = io.TextIOWrapper(stream, encoding='utf-8', newline='\n')
+        return self
+
+    def write(self, post):
+        """Write one post
+        
+        Returns:
+            int: Size of the post's record in bytes, before compression
+        """
+        if self.output_format == "ndjson":
+            text = json.dumps(post, ensure_ascii=False, separators=(',', ':')) + '\n'
+        elif self.output_format == "json-compact":
+            text = (',' if self.count else '[') + json.dumps(post, ensure_ascii=False, separators=(',', ':'))
+        else:
+            text = (',\n  ' if self.count else '[\n  ') + \
+                json.dumps(post, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+        self._file.write(text)
+        self.count += 1
+        return len(text.encode('utf-8'))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                if self.output_format == "json-compact":
+                    self._file.write(']' if self.count else '[]')
+                elif self.output_format == "json":
+                    self._file.write('\n]' if self.count else '[]')
+            # Closing the wrapper flushes the gzip stream but leaves the file beneath it open
+            self._file.close()
+            self._raw.close()
+            if exc_type is None:
+                os.replace(self._tmp_path, self.output_file)
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.unlink(self._tmp_path)
+        return False
+
+
+def iter_posts(path):
+    """Read posts written by PostWriter as a stream
+
+    Handles JSON arrays (indented or compact) and NDJSON, gzipped or not,
+    decoding one post at a time so the whole file is never in memory.
+
+    Yields:
+        dict: Each post in file order
+    """
+    with open(path, 'rb') as raw:
+        compressed = raw.read(2) == b'\x1f\x8b'
+    opener = gzip.open if compressed else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        buffer = ''
+        while not buffer.strip():
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            buffer += chunk
+        buffer = buffer.lstrip()
+        if buffer[0] == '[':
+            yield from _iter_array(f, buffer[1:])
+        else:
+            yield from _iter_lines(f, buffer)
+
+
+def _iter_lines(f, buffer):
+    """Decode NDJSON, starting with text already read into ``buffer``"""
+    while True:
+        lines = buffer.split('\n')
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+def _iter_array(f, buffer):
+    """Decode the elements of a JSON array one at a time"""
+    decoder = json.JSONDecoder()
+    eof = False
+    pos = 0
+    while True:
+        # Skip whitespace and separators between elements
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            post, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield post
+        pos = end
@@ -0,0 +1,231 @@
+from html.parser import HTMLParser
+
+from html_converter import make_text_nodes, style_text_align
+
+HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# Elements that never have children or an end tag
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+}
+
+# Elements whose text BeautifulSoup leaves out of get_text()
+HIDDEN_TEXT_ELEMENTS = {'script', 'style', 'template', 'rt', 'rp'}
+
+# Elements inside which BeautifulSoup keeps whitespace-only strings as they are
+PRESERVE_WHITESPACE_ELEMENTS = {'pre', 'textarea'}
+
+# Characters BeautifulSoup counts as whitespace when collapsing strings
+_ASCII_SPACES = dict.fromkeys(map(ord, '\x20\x0a\x09\x0c\x0d'))
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class _Frame:
+    """An open element and the text it has collected so far
+
+    ``role`` says what the element becomes in the doc: ``block`` for a
+    top-level paragraph, heading or list item, ``list`` for a top-level
+    list, ``item`` for a list item of such a list, ``span`` for a direct
+    span child of a block or item, and None for everything else.
+    """
+
+    __slots__ = ('tag', 'style', 'role', 'text', 'has_spans', 'content', 'items')
+
+    def __init__(self, tag, style, role):
+        self.tag = tag
+        self.style = style
+        self.role = role
+        self.text = [] if role in ('block', 'item', 'span') else None
+        self.has_spans = False
+        self.content = []
+        self.items = []
+
+
+class StreamingDocBuilder(HTMLParser):
+    """Build doc nodes straight from parser events in a single pass
+
+    Produces the same nodes as ``process_element`` on a BeautifulSoup tree,
+    but only keeps the currently open elements and the text of the top-level
+    element being built, instead of a tree for the whole page.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.nodes = []
+        self._stack = []
+        self._capturing = []
+        self._hidden = 0
+        self._preserve = 0
+        self._pending = []
+        self._closed_void = []
+
+    def _flush(self):
+        """Hand the text since the last markup event to the capturing elements
+
+        BeautifulSoup turns each such run of text into one string, and
+        collapses it to a single newline or space if it is all whitespace.
+        """
+        if not self._pending:
+            return
+        text = ''.join(self._pending)
+        self._pending = []
+        if self._hidden:
+            return
+        if not self._preserve and not text.translate(_ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        for frame in self._capturing:
+            frame.text.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        style = ''
+        for name, value in attrs:
+            if name == 'style':
+                style = value or ''
+
+        parent = self._stack[-1] if self._stack else None
+        if tag in VOID_ELEMENTS:
+            # Closed straight away; a later </br> only cancels this one out
+            self._closed_void.append(tag)
+            if parent is None and tag == 'br':
+                self.nodes.append({"type": "hard_break"})
+            return
+        if parent is None:
+            if tag in ('div', 'p', 'li') or tag in HEADINGS:
+                role = 'block'
+            elif tag in ('ul', 'ol'):
+                role = 'list'
+            else:
+                role = None
+        elif tag == 'span' and parent.role in ('block', 'item'):
+            role = 'span'
+            parent.has_spans = True
+        elif tag == 'li' and parent.role == 'list':
+            role = 'item'
+        else:
+            role = None
+
+        frame = _Frame(tag, style, role)
+        self._stack.append(frame)
+        if frame.text is not None:
+            self._capturing.append(frame)
+        if tag in HIDDEN_TEXT_ELEMENTS:
+            self._hidden += 1
+        if tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self._preserve += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in VOID_ELEMENTS:
+            self._closed_void.remove(tag)
+        else:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void:
+            self._closed_void.remove(tag)
+            return
+        self._flush()
+        # Like BeautifulSoup, an end tag closes everything opened after its
+        # start tag, and an end tag without a start tag is ignored
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].tag == tag:
+                while len(self._stack) > i:
+                    self._pop()
+                return
+
+    def handle_data(self, data):
+        self._pending.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+
+    def close(self):
+        super().close()
+        self._flush()
+        while self._stack:
+            self._pop()
+
+    def _pop(self):
+        frame = self._stack.pop()
+        if frame.text is not None:
+            self._capturing.pop()
+        if frame.tag in HIDDEN_TEXT_ELEMENTS:
+            self._hidden -= 1
+        if frame.tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self._preserve -= 1
+
+        if frame.role == 'span':
+            parent = self._stack[-1]
+            parent.content.extend(make_text_nodes(''.join(frame.text), frame.tag, frame.style))
+        elif frame.role == 'item':
+            self._stack[-1].items.append(self._list_item(frame))
+        elif frame.role == 'list':
+            self.nodes.append({
+                "type": "bullet_list" if frame.tag == 'ul' else "ordered_list",
+                "content": frame.items
+            })
+        elif frame.role == 'block':
+            self.nodes.append(self._block(frame))
+
+    def _inline_content(self, frame):
+        """Text nodes of the element's direct spans, or of its whole text if it has none"""
+        if frame.has_spans:
+            return frame.content
+        return make_text_nodes(''.join(frame.text), frame.tag, frame.style)
+
+    def _list_item(self, frame):
+        return {
+            "type": "list_item",
+            "content": [{
+                "type": "paragraph",
+                "content": self._inline_content(frame)
+            }]
+        }
+
+    def _block(self, frame):
+        if frame.tag == 'li':
+            return self._list_item(frame)
+
+        content = self._inline_content(frame)
+        text_align = style_text_align(frame.style)
+        if frame.tag in HEADINGS:
+            attrs = {"level": int(frame.tag[1])}
+            node_type = "heading"
+        else:
+            attrs = {}
+            node_type = "paragraph"
+        if text_align is not None:
+            attrs['textAlign'] = text_align
+        return {
+            "type": node_type,
+            "attrs": attrs,
+            "content": content
+        }
+
+
+def convert_html_stream(html_file):
+    """Convert an open text file of Coda export HTML into doc content nodes
+
+    Args:
+        html_file: A file object opened in text mode
+
+    Returns:
+        list: The top-level content nodes
+    """
+    builder = StreamingDocBuilder()
+    for chunk in iter(lambda: html_file.read(READ_CHUNK_SIZE), ''):
+        builder.feed(chunk)
+    builder.close()
+    return builder.nodes